@@ -1,17 +1,42 @@
 # -*- coding: utf-8 -*-
 
-from .ndb.types import (
-    NdbObjectType
-)
-
-from .ndb.fields import (
-    NdbConnectionField,
-)
+import importlib
+import sys
+import types
 
 __author__ = 'Eran Kampf'
 __version__ = '2.0.0'
 
 __all__ = [
-    NdbObjectType,
-    NdbConnectionField,
+    'NdbObjectType',
+    'NdbConnectionField',
 ]
+
+# Exported names => the modules defining them, imported on first access so that importing
+# graphene_gae (i.e. graphene_gae.webapp2) doesn't import graphene, the NDB converters and inflect
+_lazy_exports = {
+    'NdbObjectType': '.ndb.types',
+    'NdbConnectionField': '.ndb.fields',
+}
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        module_name = _lazy_exports.get(name)
+        if module_name is None:
+            raise AttributeError("module '{}' has no attribute '{}'".format(self.__name__, name))
+
+        value = getattr(importlib.import_module(module_name, self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_exports))
+
+
+# Python 2 has no module level __getattr__, so replace this module with a _LazyModule.
+# The original module is kept referenced as Python 2 clears a module's globals when it's collected.
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
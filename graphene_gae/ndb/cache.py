@@ -0,0 +1,76 @@
+import hashlib
+import time
+
+import six
+
+from google.appengine.api import memcache, namespace_manager
+
+
+__author__ = 'ekampf'
+
+
+CACHE_KEY_PREFIX = 'graphene_gae'
+
+
+def _generation_cache_key(kind):
+    return '%s:generation:%s' % (CACHE_KEY_PREFIX, kind)
+
+
+def _new_generation():
+    return int(time.time() * 1000)
+
+
+def query_shape_cache_key(query, **params):
+    '''
+    Returns a memcache key identifying the shape of query (kind, ancestor, filters, orders,
+    namespace...) combined with the given params (pagination arguments and such).
+    '''
+    namespace = query.namespace if query.namespace is not None else namespace_manager.get_namespace()
+    shape = repr((repr(query), namespace, sorted(params.items())))
+    return '%s:query:%s' % (CACHE_KEY_PREFIX, hashlib.md5(shape).hexdigest())
+
+
+def get_cached_query_result(query, cache_key):
+    '''
+    Returns a (generation, value) tuple - value is None unless a value was cached under cache_key
+    since the last time query's kind was invalidated. Both are read with a single memcache RPC.
+    '''
+    generation_key = _generation_cache_key(query.kind)
+    cached = memcache.get_multi([generation_key, cache_key])
+
+    generation = cached.get(generation_key)
+    if generation is None:
+        generation = _new_generation()
+        if not memcache.add(generation_key, generation):
+            generation = memcache.get(generation_key)
+
+        return generation, None
+
+    value = cached.get(cache_key)
+    if value is None or value[0] != generation:
+        return generation, None
+
+    return generation, value[1]
+
+
+def set_cached_query_result(cache_key, generation, value, ttl):
+    memcache.set(cache_key, (generation, value), time=ttl)
+
+
+def invalidate_query_cache(kind):
+    '''
+    Invalidates all cached query results of kind (an ndb.Model class or a kind name).
+    Meant to be called from a model's _post_put_hook and _post_delete_hook:
+
+        class Article(ndb.Model):
+            def _post_put_hook(self, future):
+                invalidate_query_cache(Article)
+
+            @classmethod
+            def _post_delete_hook(cls, key, future):
+                invalidate_query_cache(Article)
+    '''
+    if not isinstance(kind, six.string_types):
+        kind = kind._get_kind()
+
+    memcache.incr(_generation_cache_key(kind), initial_value=_new_generation())
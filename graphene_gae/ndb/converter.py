@@ -1,21 +1,35 @@
 from collections import namedtuple
 
-import inflect
-
 from google.appengine.ext import ndb
 
 from graphene import String, Boolean, Int, Float, List, NonNull, Field, Dynamic
 from graphene.types.json import JSONString
 from graphene.types.datetime import DateTime, Time
 
+from ..utils import LRUCache
 from .fields import DynamicNdbKeyStringField, DynamicNdbKeyReferenceField
 
 __author__ = 'ekampf'
 
 ConversionResult = namedtuple('ConversionResult', ['name', 'field'])
 
+_inflect_engine = None
+
+# Maps (KeyProperty code name, repeated) => (id string field, reference field) names
+key_field_names_cache = LRUCache(max_size=1000)
+
+# Same, loaded from a schema snapshot (see graphene_gae.ndb.snapshot) - a dict, so no names are evicted
+snapshot_key_field_names = {}
+
 
-p = inflect.engine()
+def get_inflect_engine():
+    # inflect is slow to import and to create an engine for, and only needed to name KeyProperty fields
+    global _inflect_engine
+    if _inflect_engine is None:
+        import inflect
+        _inflect_engine = inflect.engine()
+
+    return _inflect_engine
 
 
 def rreplace(s, old, new, occurrence):
@@ -64,7 +78,38 @@ def convert_ndb_datetime_property(ndb_prop, registry=None):
     return Field(DateTime, description=ndb_prop._name)
 
 
-def convert_ndb_key_propety(ndb_key_prop, registry=None):
+def get_key_field_names(ndb_key_prop):
+    '''
+    Returns the names of the (id string field, reference field) pair a KeyProperty is converted to.
+    '''
+    cache_key = (ndb_key_prop._code_name, ndb_key_prop._repeated)
+    field_names = snapshot_key_field_names.get(cache_key)
+    if field_names is not None:
+        return field_names
+
+    field_names = key_field_names_cache.get(cache_key)
+    if field_names is None:
+        field_names = derive_key_field_names(*cache_key)
+        key_field_names_cache.set(cache_key, field_names)
+
+    return field_names
+
+
+def derive_key_field_names(name, is_repeated):
+    if name.endswith('_key') or name.endswith('_keys'):
+        # Case #1 - name is of form 'store_key' or 'store_keys'
+        string_prop_name = rreplace(name, '_key', '_id', 1)
+        resolved_prop_name = name[:-4] if name.endswith('_key') else get_inflect_engine().plural(name[:-5])
+    else:
+        # Case #2 - name is of form 'store'
+        singular_name = get_inflect_engine().singular_noun(name) or name
+        string_prop_name = singular_name + '_ids' if is_repeated else singular_name + '_id'
+        resolved_prop_name = name
+
+    return string_prop_name, resolved_prop_name
+
+
+def convert_ndb_key_propety(ndb_key_prop, registry=None, async_key_references=False, field_names=None):
     """
     Two conventions for handling KeyProperties:
     #1.
@@ -83,23 +128,16 @@ def convert_ndb_key_propety(ndb_key_prop, registry=None):
             store_id = graphene.String() -> resolves to store_key.urlsafe()
             store     = NdbKeyField()    -> resolves to entity
 
+    field_names - precomputed (id string field, reference field) names (see get_key_field_names)
     """
-    is_repeated = ndb_key_prop._repeated
-    name = ndb_key_prop._code_name
-
-    if name.endswith('_key') or name.endswith('_keys'):
-        # Case #1 - name is of form 'store_key' or 'store_keys'
-        string_prop_name = rreplace(name, '_key', '_id', 1)
-        resolved_prop_name = name[:-4] if name.endswith('_key') else p.plural(name[:-5])
-    else:
-        # Case #2 - name is of form 'store'
-        singular_name = p.singular_noun(name) if p.singular_noun(name) else name
-        string_prop_name = singular_name + '_ids' if is_repeated else singular_name + '_id'
-        resolved_prop_name = name
+    string_prop_name, resolved_prop_name = field_names or get_key_field_names(ndb_key_prop)
 
     return [
         ConversionResult(name=string_prop_name, field=DynamicNdbKeyStringField(ndb_key_prop, registry=registry)),
-        ConversionResult(name=resolved_prop_name, field=DynamicNdbKeyReferenceField(ndb_key_prop, registry=registry))
+        ConversionResult(
+            name=resolved_prop_name,
+            field=DynamicNdbKeyReferenceField(ndb_key_prop, registry=registry, use_async=async_key_references)
+        )
     ]
 
 
@@ -109,7 +147,7 @@ def convert_local_structured_property(ndb_structured_property, registry=None):
     model = ndb_structured_property._modelclass
     name = ndb_structured_property._code_name
 
-    def dynamic_type():
+    def create_field():
         _type = registry.get_type_for_model(model)
         if not _type:
             return None
@@ -122,6 +160,9 @@ def convert_local_structured_property(ndb_structured_property, registry=None):
 
         return Field(_type)
 
+    def dynamic_type():
+        return registry.get_dynamic_field(ndb_structured_property, 'structured', create_field)
+
     field = Dynamic(dynamic_type)
     return ConversionResult(name=name, field=field)
 
@@ -147,12 +188,15 @@ converters = {
 }
 
 
-def convert_ndb_property(prop, registry=None):
+def convert_ndb_property(prop, registry=None, async_key_references=False, key_field_names=None):
     converter_func = converters.get(type(prop))
     if not converter_func:
         raise Exception("Don't know how to convert NDB field %s (%s)" % (prop._code_name, prop))
 
-    field = converter_func(prop, registry)
+    if converter_func is convert_ndb_key_propety:
+        field = converter_func(prop, registry, async_key_references=async_key_references, field_names=key_field_names)
+    else:
+        field = converter_func(prop, registry)
     if not field:
         raise Exception("Failed to convert NDB propeerty to a GraphQL field %s (%s)" % (prop._code_name, prop))
 
@@ -0,0 +1,43 @@
+from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
+
+from graphql.execution.executors.sync import SyncExecutor
+from promise import Promise
+
+
+__author__ = 'ekampf'
+
+
+def future_to_promise(future):
+    def executor(resolve, reject):
+        def on_done():
+            exception = future.get_exception()
+            if exception is not None:
+                reject(exception)
+            else:
+                resolve(future.get_result())
+
+        future.add_immediate_callback(on_done)
+
+    return Promise(executor)
+
+
+class NdbExecutor(SyncExecutor):
+    '''
+    A graphql-core executor that lets resolvers return ndb.Futures.
+    Futures are wrapped in promises and the NDB event loop is run until all of
+    them complete, so RPCs started by sibling fields overlap instead of running
+    one after another.
+
+        schema.execute(query, executor=NdbExecutor())
+    '''
+
+    def wait_until_finished(self):
+        eventloop.run()
+
+    def execute(self, fn, *args, **kwargs):
+        result = fn(*args, **kwargs)
+        if isinstance(result, ndb.Future):
+            return future_to_promise(result)
+
+        return result
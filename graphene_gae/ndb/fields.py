@@ -1,45 +1,603 @@
+from collections import OrderedDict
 from functools import partial
+import time
 import six
 
+from google.appengine.datastore import datastore_query
 from google.appengine.ext import ndb
 from google.appengine.ext.db import BadArgumentError, Timeout
 from google.appengine.runtime import DeadlineExceededError
 
+from graphql import GraphQLError
+from graphql.language import ast
 from graphql_relay import to_global_id
 from graphql_relay.connection.connectiontypes import Edge
 from graphene import Argument, Boolean, Int, String, Field, List, NonNull, Dynamic
 from graphene.relay import Connection
 from graphene.relay.connection import PageInfo, ConnectionField
+from graphene.utils.str_converters import to_camel_case
+from promise import Promise
+from promise.dataloader import DataLoader
 
 
+from ..utils import LRUCache
+from .cache import query_shape_cache_key, get_cached_query_result, set_cached_query_result
 from .registry import get_global_registry
 
 
 __author__ = 'ekampf'
 
 
-def generate_edges_page(ndb_iter, page_size, keys_only, edge_type):
+class NdbKeyLoader(DataLoader):
+    '''
+    Collects the ndb.Keys requested while resolving one level of a GraphQL query
+    and fetches them with a single ndb.get_multi_async call.
+    Results aren't cached between batches - NDB's in-context cache already does that.
+    '''
+    cache = False
+
+    def batch_load_fn(self, keys):
+        unique_keys = list(OrderedDict.fromkeys(keys))
+        futures = ndb.get_multi_async(unique_keys)
+        entities = dict(zip(unique_keys, [f.get_result() for f in futures]))
+        return Promise.resolve([entities[key] for key in keys])
+
+
+def get_key_loader():
+    '''
+    Returns the NdbKeyLoader of the current NDB context (one per request).
+    '''
+    ctx = ndb.get_context()
+    loader = getattr(ctx, '_graphene_key_loader', None)
+    if loader is None:
+        loader = ctx._graphene_key_loader = NdbKeyLoader()
+
+    return loader
+
+
+@ndb.tasklet
+def get_multi_tasklet(keys):
+    entities = yield ndb.get_multi_async(keys)
+    raise ndb.Return(entities)
+
+
+def iter_selections(selections, fragments):
+    for selection in selections:
+        if isinstance(selection, ast.FragmentSpread):
+            fragment = fragments[selection.name.value]
+            for s in iter_selections(fragment.selection_set.selections, fragments):
+                yield s
+        elif isinstance(selection, ast.InlineFragment):
+            for s in iter_selections(selection.selection_set.selections, fragments):
+                yield s
+        else:
+            yield selection
+
+
+def get_selected_fields(field_asts, fragments, path=()):
+    '''
+    Returns the names of the fields selected under path (i.e. ('edges', 'node')) by the given
+    field ASTs, following fragment spreads and inline fragments.
+    '''
+    selections = [s for f in field_asts if f.selection_set for s in f.selection_set.selections]
+    for name in path:
+        selections = [
+            sub for s in iter_selections(selections, fragments)
+            if s.name.value == name and s.selection_set
+            for sub in s.selection_set.selections
+        ]
+
+    return set(s.name.value for s in iter_selections(selections, fragments))
+
+
+KEY_FIELD_NAMES = ('__typename', 'id', 'ndbId', 'ndb_id')
+
+UNPROJECTABLE_PROPERTY_TYPES = (ndb.StructuredProperty, ndb.LocalStructuredProperty, ndb.ComputedProperty)
+
+
+def get_equality_filtered_properties(node):
+    '''
+    Returns the names of the properties with an equality filter in a query's filters,
+    or None if they can't be determined.
+    '''
+    if node is None:
+        return set()
+
+    if isinstance(node, (ndb.ConjunctionNode, ndb.DisjunctionNode)):
+        names = set()
+        for child in node:
+            child_names = get_equality_filtered_properties(child)
+            if child_names is None:
+                return None
+
+            names.update(child_names)
+
+        return names
+
+    if isinstance(node, ndb.FilterNode):
+        name, opsymbol, _ = node.__getnewargs__()
+        return set([name]) if opsymbol == '=' else set()
+
+    return None
+
+
+def get_projection(query, node_type, selected_fields):
+    '''
+    Returns the projection needed to resolve selected_fields of node_type entities returned by query,
+    or None if one of the fields isn't backed by an indexed, non repeated property.
+    Fields the type declares or resolves itself (resolve_<name>) may read any property, so they aren't projected.
+    '''
+    model = node_type._meta.model
+    if query.projection or query.kind != model._get_kind() or hasattr(model, '_class_key'):
+        return None
+
+    fields = node_type._meta.fields
+    ndb_fields = node_type._meta.ndb_fields or {}
+    properties = {}
+    for name, prop in (node_type._meta.ndb_properties or {}).items():
+        if fields.get(name) is not ndb_fields.get(name) or hasattr(node_type, 'resolve_' + name):
+            continue
+
+        properties[name] = properties[to_camel_case(name)] = prop
+
+    projection = set()
+    for field_name in selected_fields:
+        if field_name in KEY_FIELD_NAMES:
+            continue
+
+        prop = properties.get(field_name)
+        if prop is None or not prop._indexed or prop._repeated or isinstance(prop, UNPROJECTABLE_PROPERTY_TYPES):
+            return None
+
+        projection.add(prop._name)
+
+    # Properties with an equality filter can't be projected
+    filtered = get_equality_filtered_properties(query.filters)
+    if not projection or filtered is None or projection & filtered:
+        return None
+
+    return tuple(sorted(projection))
+
+
+# Separates the positions after and before an edge in its cursor (not a urlsafe base64 character)
+CURSOR_SEPARATOR = '.'
+
+
+class LazyCursor(object):
+    '''
+    An edge cursor that is only computed and encoded when it's serialized - i.e. when a client
+    actually selects the edge's cursor field. Wraps either the ndb.Cursors after and before the
+    edge's result, or a query batch and the index of the result.
+    The cursor holds both positions (see parse_cursor), so that after skips the edge and before
+    stops short of it - even when the edge was deleted since.
+    With reverse=True the cursors come from a reversed query (see reverse_query) and are reversed
+    to the original query's order.
+    '''
+    __slots__ = ('_cursor', '_before_cursor', '_batch', '_index', '_reverse', '_urlsafe')
+
+    def __init__(self, cursor=None, before_cursor=None, batch=None, index=None, reverse=False):
+        self._cursor = cursor
+        self._before_cursor = before_cursor
+        self._batch = batch
+        self._index = index
+        self._reverse = reverse
+        self._urlsafe = None
+
+    def _compute(self):
+        if self._batch is not None:
+            self._cursor = batch_cursor(self._batch, self._index + 1)
+            self._before_cursor = batch_cursor(self._batch, self._index)
+            if self._reverse:
+                self._cursor, self._before_cursor = self._before_cursor, self._cursor
+
+            self._batch = None
+
+        if self._reverse:
+            self._cursor = self._cursor and self._cursor.reversed()
+            self._before_cursor = self._before_cursor and self._before_cursor.reversed()
+            self._reverse = False
+
+    @property
+    def cursor(self):
+        self._compute()
+        return self._cursor
+
+    @property
+    def before_cursor(self):
+        self._compute()
+        return self._before_cursor
+
+    def urlsafe(self):
+        if self._urlsafe is None:
+            cursor, before_cursor = self.cursor, self.before_cursor
+            self._urlsafe = cursor.urlsafe() if cursor else ''
+            if cursor and before_cursor:
+                self._urlsafe += CURSOR_SEPARATOR + before_cursor.urlsafe()
+
+        return self._urlsafe
+
+    def __str__(self):
+        return self.urlsafe()
+
+    def __unicode__(self):
+        return six.text_type(self.urlsafe())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyCursor):
+            other = other.urlsafe()
+
+        return self.urlsafe() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.urlsafe())
+
+    def __repr__(self):
+        return 'LazyCursor(%r)' % self.cursor
+
+
+def encode_cursor(cursor):
+    return cursor.urlsafe() if isinstance(cursor, LazyCursor) else cursor
+
+
+def encode_edge_cursors(edges):
+    '''
+    Replaces the LazyCursors of edges with their urlsafe strings, for code that expects plain string cursors.
+    '''
+    for edge in edges:
+        edge.cursor = encode_cursor(edge.cursor)
+
+    return edges
+
+
+class NdbPageInfo(PageInfo):
+    truncated = Boolean(
+        description='Was the page cut short by datastore timeouts or by the field\'s deadline?'
+    )
+
+
+class NdbConnection(Connection):
+    '''
+    Base class of the connections created for NdbObjectTypes.
+    totalCount is only counted when it's selected (see NdbConnectionField count options).
+    '''
+    class Meta:
+        abstract = True
+
+    page_info = Field(NdbPageInfo, name='pageInfo', required=True)
+    total_count = Int(description='Total number of results (up to the field\'s count limit)')
+
+    def resolve_total_count(self, info):
+        count = getattr(self, '_total_count', None)
+        return count.get_result() if isinstance(count, ndb.Future) else count
+
+
+def get_counter_cache_key(counter):
+    '''
+    Identifies counter in count cache keys by its module and name. Lambdas, partials and callable objects
+    are identified by their repr(), which differs between instances - pass them a counter_cache_key.
+    '''
+    name = getattr(counter, '__name__', None)
+    if name is None or name == '<lambda>':
+        return repr(counter)
+
+    return '%s.%s' % (getattr(counter, '__module__', None), name)
+
+
+@ndb.tasklet
+def count_query_async(query, limit=None, cache_ttl=None, counter=None, counter_cache_key=None):
+    '''
+    Counts the results of query (up to limit) - or calls counter(query), which may return a
+    number or a future (i.e. of a sharded counter), when given.
+    With cache_ttl the count is cached in memcache by query shape (see graphene_gae.ndb.cache)
+    and counter_cache_key (see get_counter_cache_key).
+    '''
+    if cache_ttl:
+        if counter and not counter_cache_key:
+            counter_cache_key = get_counter_cache_key(counter)
+
+        cache_key = query_shape_cache_key(query, count_limit=limit, counter=counter_cache_key)
+        cache_generation, count = get_cached_query_result(query, cache_key)
+        if count is not None:
+            raise ndb.Return(count)
+
+    if counter:
+        count = counter(query)
+        if isinstance(count, ndb.Future):
+            count = yield count
+    else:
+        count = yield query.count_async(limit=limit)
+
+    if cache_ttl:
+        set_cached_query_result(cache_key, cache_generation, count, cache_ttl)
+
+    raise ndb.Return(count)
+
+
+INEQUALITY_OPERATORS = ('<', '<=', '>', '>=', '!=')
+
+
+def get_inequality_filtered_property(node):
+    '''
+    Returns the name of the property with an inequality filter in a query's filters, or None.
+    '''
+    if isinstance(node, (ndb.ConjunctionNode, ndb.DisjunctionNode)):
+        for child in node:
+            name = get_inequality_filtered_property(child)
+            if name:
+                return name
+
+    elif isinstance(node, ndb.FilterNode):
+        name, opsymbol, _ = node.__getnewargs__()
+        if opsymbol in INEQUALITY_OPERATORS:
+            return name
+
+    return None
+
+
+def reverse_query(query):
+    '''
+    Returns a copy of query with its sort orders reversed (the key is used as the last sort order so
+    that results with equal values come out in exactly the reverse order).
+    Reversed queries need matching descending indexes.
+    '''
+    key_order = datastore_query.PropertyOrder('__key__')
+    if query.orders:
+        orders = datastore_query.CompositeOrder([query.orders, key_order])
+    else:
+        # The datastore implicitly sorts by the inequality filtered property first, the reversed query must too
+        inequality_property = get_inequality_filtered_property(query.filters)
+        if inequality_property:
+            orders = datastore_query.CompositeOrder([datastore_query.PropertyOrder(inequality_property), key_order])
+        else:
+            orders = key_order
+
+    return query.__class__(kind=query.kind, ancestor=query.ancestor,
+                           filters=query.filters, orders=orders.reversed(),
+                           app=query.app, namespace=query.namespace,
+                           default_options=query.default_options,
+                           projection=query.projection, group_by=query.group_by)
+
+
+def parse_cursor(urlsafe_cursor):
+    '''
+    Returns the (after, before) ndb.Cursors an edge cursor holds (see LazyCursor).
+    Cursors of a single position (i.e. pageInfo.endCursor) are that position both ways.
+    '''
+    after, _, before = urlsafe_cursor.partition(CURSOR_SEPARATOR)
+    after = ndb.Cursor(urlsafe=after)
+    return after, ndb.Cursor(urlsafe=before) if before else after
+
+
+class RetryPolicy(object):
+    '''
+    How NdbConnectionField deals with datastore errors while fetching a page:
+    * max_retries - how many datastore Timeouts to retry before giving up on the rest of the page
+    * backoff - seconds to wait before the first retry, doubled on every following retry
+    * deadline - seconds the field may spend fetching its page before returning the edges it has so far
+    Pages that are cut short are flagged with pageInfo.truncated.
+    '''
+    def __init__(self, max_retries=2, backoff=0, deadline=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+
+    def start(self):
+        return RetryBudget(self)
+
+
+class RetryBudget(object):
+    '''
+    The retries and time left for fetching a single page under a RetryPolicy.
+    '''
+    def __init__(self, policy):
+        self.policy = policy
+        self.retries = 0
+        self.truncated = False
+        self.expires_at = time.time() + policy.deadline if policy.deadline is not None else None
+
+    def retry_delay(self):
+        '''
+        Returns the seconds to wait before retrying after a Timeout,
+        or None (and marks the page truncated) when out of retries.
+        '''
+        if self.retries >= self.policy.max_retries or self.expired():
+            self.truncated = True
+            return None
+
+        delay = self.policy.backoff * 2 ** self.retries
+        self.retries += 1
+        return delay
+
+    def expired(self):
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            self.truncated = True
+
+        return self.truncated
+
+
+def generate_edges_page(ndb_iter, page_size, keys_only, edge_type, reverse=False, retry_budget=None):
+    retry_budget = retry_budget or RetryPolicy().start()
     edges = []
-    timeouts = 0
-    while len(edges) < page_size:
+    while len(edges) < page_size and not retry_budget.expired():
         try:
             entity = ndb_iter.next()
         except StopIteration:
             break
         except Timeout:
-            timeouts += 1
-            if timeouts > 2:
+            delay = retry_budget.retry_delay()
+            if delay is None:
                 break
 
+            if delay:
+                # Runs the event loop while waiting, so sibling connections keep fetching their pages
+                ndb.sleep(delay).get_result()
+
             continue
         except DeadlineExceededError:
+            retry_budget.truncated = True
             break
 
         if keys_only:
             # entity is actualy an ndb.Key and we need to create an empty entity to hold it
             entity = edge_type._meta.fields['node']._type._meta.model(key=entity)
 
-        edges.append(edge_type(node=entity, cursor=ndb_iter.cursor_after().urlsafe()))
+        cursor, before_cursor = ndb_iter.cursor_after(), ndb_iter.cursor_before()
+        if reverse:
+            cursor, before_cursor = before_cursor, cursor
+
+        edges.append(edge_type(node=entity, cursor=LazyCursor(cursor, before_cursor, reverse=reverse)))
+
+    return edges
+
+
+def fetch_edge_nodes(edges):
+    '''
+    Replaces the ndb.Key nodes of the given edges with their entities, fetched with
+    a single ndb.get_multi_async call (served from NDB's in-context cache and memcache
+    when possible). Edges whose entity no longer exists are dropped.
+    '''
+    futures = ndb.get_multi_async([edge.node for edge in edges])
+    for edge, future in zip(edges, futures):
+        edge.node = future.get_result()
+
+    return [edge for edge in edges if edge.node is not None]
+
+
+def _result_with_batch(batch, index, entity):
+    return entity, batch, index
+
+
+@ndb.tasklet
+def fetch_page_async(query, page_size, **q_options):
+    '''
+    Fetches up to page_size results of query, and whether more results follow, by fetching
+    page_size + 1 results in a single batch. This saves the extra RPC QueryIterator.has_next()
+    makes at the end of a page.
+    Returns a (results, more) tuple where results are (entity, batch, index) tuples.
+    '''
+    q_options.update(limit=page_size + 1, batch_size=page_size + 1, produce_cursors=True)
+    results = yield query.map_async(_result_with_batch, pass_batch_into_callback=True, **q_options)
+    raise ndb.Return(results[:page_size], len(results) > page_size)
+
+
+def batch_cursor(batch, index):
+    '''
+    Returns the cursor pointing before the result at index of batch (after the result at index - 1).
+    '''
+    if batch is None:
+        # Queries that merge several queries (IN, != or OR filters) don't produce cursors
+        return None
+
+    try:
+        return batch.cursor(index)
+    except BadArgumentError:
+        return None
+
+
+def edges_from_results(results, keys_only, edge_type, edge_cursors=True, reverse=False):
+    model = edge_type._meta.fields['node']._type._meta.model
+    edges = []
+    for entity, batch, index in results:
+        if keys_only:
+            # entity is actualy an ndb.Key and we need to create an empty entity to hold it
+            entity = model(key=entity)
+
+        cursor = LazyCursor(batch=batch, index=index, reverse=reverse) if edge_cursors and batch is not None else None
+        edges.append(edge_type(node=entity, cursor=cursor))
+
+    return edges
+
+
+@ndb.tasklet
+def iterate_edges_async(query, page_size, keys_only, edge_type, complete_edges, batch_size=20, reverse=False,
+                        retry_budget=None, **q_options):
+    '''
+    Builds a page of edges by iterating over query one entity at a time.
+    Returns a future of an (edges, end_cursor, more) tuple.
+    '''
+    retry_budget = retry_budget or RetryPolicy().start()
+    ndb_iter = query.iter(produce_cursors=True, batch_size=batch_size, **q_options)
+    yield ndb_iter.has_next_async()
+
+    edges = []
+    while len(edges) < page_size:
+        missing_edges_count = page_size - len(edges)
+        edges_page = generate_edges_page(ndb_iter, missing_edges_count, keys_only, edge_type, reverse, retry_budget)
+
+        edges.extend(complete_edges(edges_page))
+
+        if len(edges_page) < missing_edges_count:
+            break
+
+    try:
+        end_cursor = ndb_iter.cursor_after()
+    except BadArgumentError:
+        end_cursor = None
+
+    if retry_budget.truncated:
+        # Don't spend another RPC (or what's left of the deadline) on finding out
+        more = True
+    else:
+        more = yield ndb_iter.has_next_async()
+
+    raise ndb.Return(edges, end_cursor, more)
+
+
+@ndb.tasklet
+def fetch_edges_async(query, page_size, keys_only, edge_type, complete_edges, start_cursor=None, edge_cursors=True,
+                      reverse=False, retry_budget=None, **q_options):
+    '''
+    Builds a page of edges from page_size + 1 results fetched in a single batch (see fetch_page_async),
+    fetching more pages only when complete_edges filters out some of the edges.
+    Per edge cursors are only computed when edge_cursors is set - the end cursor always is.
+    Returns a future of an (edges, end_cursor, more) tuple.
+    '''
+    retry_budget = retry_budget or RetryPolicy().start()
+    edges = []
+    end_cursor = None
+    more = True
+    while more and len(edges) < page_size and not retry_budget.expired():
+        missing_edges_count = page_size - len(edges)
+        try:
+            results, more = yield fetch_page_async(query, missing_edges_count, start_cursor=start_cursor, **q_options)
+        except Timeout:
+            delay = retry_budget.retry_delay()
+            if delay is None:
+                break
+
+            if delay:
+                yield ndb.sleep(delay)
+
+            continue
+        except DeadlineExceededError:
+            retry_budget.truncated = True
+            break
+
+        # An offset only applies to the first page, the following ones start at its end cursor
+        q_options.pop('offset', None)
+
+        edges.extend(complete_edges(edges_from_results(results, keys_only, edge_type, edge_cursors, reverse)))
+
+        if results:
+            _, batch, index = results[-1]
+            end_cursor = start_cursor = batch_cursor(batch, index + 1)
+            if end_cursor is None:
+                break
+
+    raise ndb.Return(edges, end_cursor, more)
+
+
+def edges_from_cached_page(page, keys_only, edge_type):
+    edges = [edge_type(node=key, cursor=cursor) for key, cursor in page['edges']]
+    if not keys_only:
+        return fetch_edge_nodes(edges)
+
+    model = edge_type._meta.fields['node']._type._meta.model
+    for edge in edges:
+        edge.node = model(key=edge.node)
 
     return edges
 
@@ -49,54 +607,198 @@ def connection_from_ndb_query(query, args=None, connection_type=None, edge_type=
     '''
     A simple function that accepts an ndb Query and used ndb QueryIterator object(https://cloud.google.com/appengine/docs/python/ndb/queries#iterators)
     to returns a connection object for use in GraphQL.
+    See connection_from_ndb_query_async for the supported arguments.
+    Unlike the async version, the cursors are encoded (urlsafe strings).
+    '''
+    connection = connection_from_ndb_query_async(
+        query, args=args, connection_type=connection_type, edge_type=edge_type, pageinfo_type=pageinfo_type,
+        transform_edges=transform_edges, context=context, **kwargs
+    ).get_result()
+    encode_edge_cursors(connection.edges)
+    connection.page_info.start_cursor = encode_cursor(connection.page_info.start_cursor)
+    connection.page_info.end_cursor = encode_cursor(connection.page_info.end_cursor)
+    return connection
+
+
+@ndb.tasklet
+def connection_from_ndb_query_async(query, args=None, connection_type=None, edge_type=None, pageinfo_type=None,
+                                    transform_edges=None, context=None, **kwargs):
+    '''
+    Returns a future of a connection object for use in GraphQL, built from an ndb Query.
+    Edge cursors are LazyCursors, only encoded when they're serialized (transform_edges gets them encoded).
     It uses array offsets as pagination,
     so pagination will only work if the array is static.
+
+    The query's first RPC is made before this function returns, so several connections
+    can fetch their pages in parallel.
+
+    Paginating backwards (last / before) runs the query with its sort orders reversed
+    (see reverse_query), which requires matching descending indexes. Edge cursors hold the
+    positions after and before their edge, so after and before both exclude it.
+    Paginating forward and backward at once (i.e. first with before) isn't supported.
+
+    With fetch_page=True the page is fetched in a single batch (see fetch_page_async) instead of
+    iterating the query one entity at a time. Passing edge_cursors=False returns the edges without
+    cursors (i.e. when edges.cursor isn't selected).
+
+    When cache_ttl is given (and there's no transform_edges) the page's keys and cursors are cached in
+    memcache by query shape, and served from there (entities are fetched by key) until they expire or
+    the query kind is invalidated with graphene_gae.ndb.cache.invalidate_query_cache.
+
+    With total_count=True the query is counted (see count_query_async and the count_limit,
+    count_cache_ttl and counter arguments) in parallel to fetching the page.
+
+    Datastore timeouts are retried according to retry_policy (a RetryPolicy), pages cut short
+    by it are flagged with page_info.truncated.
     '''
     args = args or {}
     connection_type = connection_type or Connection
     edge_type = edge_type or Edge
-    pageinfo_type = pageinfo_type or PageInfo
+    pageinfo_type = pageinfo_type or NdbPageInfo
 
     full_args = dict(args, **kwargs)
     first = full_args.get('first')
     after = full_args.get('after')
-    has_previous_page = bool(after)
+    last = full_args.get('last')
+    before = full_args.get('before')
+    if (first or after) and (last or before):
+        raise GraphQLError('Paginating forward (first / after) and backward (last / before) at once isn\'t supported.')
+
+    backwards = bool(last or before)
     keys_only = full_args.get('keys_only', False)
+    fetch_by_keys = full_args.get('fetch_by_keys', False) and not keys_only
+    projection = full_args.get('projection') or query.projection
+    cache_ttl = full_args.get('cache_ttl') if not transform_edges else None
     batch_size = full_args.get('batch_size', 20)
-    page_size = first if first else full_args.get('page_size', 20)
-    start_cursor = ndb.Cursor(urlsafe=after) if after else None
+    page_size = (last if backwards else first) or full_args.get('page_size', 20)
 
-    ndb_iter = query.iter(produce_cursors=True, start_cursor=start_cursor, batch_size=batch_size, keys_only=keys_only, projection=query.projection)
+    total_count = None
+    if full_args.get('total_count'):
+        total_count = count_query_async(
+            query, full_args.get('count_limit'), full_args.get('count_cache_ttl'), full_args.get('counter'),
+            full_args.get('counter_cache_key')
+        )
 
-    edges = []
-    while len(edges) < page_size:
-        missing_edges_count = page_size - len(edges)
-        edges_page = generate_edges_page(ndb_iter, missing_edges_count, keys_only, edge_type)
+    cached_page = None
+    if cache_ttl:
+        cache_key = query_shape_cache_key(
+            query, after=after, before=before, backwards=backwards, page_size=page_size, keys_only=keys_only, projection=projection
+        )
+        cache_generation, cached_page = get_cached_query_result(query, cache_key)
 
-        edges.extend(transform_edges(edges_page, args, context) if transform_edges else edges_page)
+    if cached_page is not None:
+        edges = edges_from_cached_page(cached_page, keys_only, edge_type)
+        page_info = cached_page['page_info']
+    else:
+        retry_budget = (full_args.get('retry_policy') or RetryPolicy()).start()
 
-        if len(edges_page) < missing_edges_count:
-            break
+        def complete_edges(edges_page):
+            nodes_page = fetch_edge_nodes(edges_page) if fetch_by_keys else edges_page
+            if not transform_edges:
+                return nodes_page
 
-    try:
-        end_cursor = ndb_iter.cursor_after().urlsafe()
-    except BadArgumentError:
-        end_cursor = None
+            return transform_edges(encode_edge_cursors(nodes_page), args, context)
+
+        if backwards:
+            query = reverse_query(query)
+            start_cursor = parse_cursor(before)[1].reversed() if before else None
+        else:
+            start_cursor = parse_cursor(after)[0] if after else None
+
+        if fetch_by_keys:
+            # Run a keys only query and get the entities by key afterwards
+            q_options = dict(start_cursor=start_cursor, keys_only=True)
+        else:
+            q_options = dict(start_cursor=start_cursor, keys_only=keys_only, projection=projection)
+
+        if full_args.get('fetch_page'):
+            # Edge cursors are lazy, so they're always created - the page info cursors come from them
+            edges, end_cursor, more = yield fetch_edges_async(
+                query, page_size, keys_only, edge_type, complete_edges, reverse=backwards,
+                retry_budget=retry_budget, **q_options
+            )
+        else:
+            edges, end_cursor, more = yield iterate_edges_async(
+                query, page_size, keys_only, edge_type, complete_edges, batch_size=batch_size, reverse=backwards,
+                retry_budget=retry_budget, **q_options
+            )
+
+        if backwards:
+            # The reversed query returns the page's last edge first
+            edges.reverse()
+            page_info = dict(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else before or None,
+                has_previous_page=more,
+                has_next_page=bool(before)
+            )
+        else:
+            # The end cursor is where the query stopped, past edges transform_edges filtered out
+            page_info = dict(
+                start_cursor=edges[0].cursor if edges else after or '',
+                end_cursor=end_cursor.urlsafe() if end_cursor else None,
+                has_previous_page=bool(after),
+                has_next_page=more
+            )
+
+        page_info['truncated'] = retry_budget.truncated
+
+        if cache_ttl and not retry_budget.truncated:
+            cached_page = dict(
+                edges=[(edge.node.key, encode_cursor(edge.cursor)) for edge in edges],
+                page_info=dict(
+                    page_info,
+                    start_cursor=encode_cursor(page_info['start_cursor']),
+                    end_cursor=encode_cursor(page_info['end_cursor'])
+                )
+            )
+            set_cached_query_result(cache_key, cache_generation, cached_page, cache_ttl)
+
+        if not full_args.get('edge_cursors', True):
+            for edge in edges:
+                edge.cursor = None
+
+    if 'truncated' not in pageinfo_type._meta.fields:
+        page_info = dict(page_info)
+        page_info.pop('truncated', None)
 
     # Construct the connection
-    return connection_type(
+    connection = connection_type(
         edges=edges,
-        page_info=pageinfo_type(
-            start_cursor=start_cursor.urlsafe() if start_cursor else '',
-            end_cursor=end_cursor,
-            has_previous_page=has_previous_page,
-            has_next_page=ndb_iter.has_next()
-        )
+        page_info=pageinfo_type(**page_info)
     )
+    connection._total_count = total_count
+    raise ndb.Return(connection)
 
 
 class NdbConnectionField(ConnectionField):
-    def __init__(self, type, transform_edges=None, *args, **kwargs):
+    '''
+    A ConnectionField for NdbObjectTypes. The resolver may return an ndb.Query (defaults to model.query()).
+
+    Options:
+    * transform_edges - a function(edges, args, context) that may replace or filter out edges
+    * fetch_by_keys - run the query keys only and get the entities by key (useful for hot, mostly cached kinds)
+    * auto_projection - when every field selected under edges.node maps to an indexed, non repeated
+                        property, run a projection query for those properties instead of fetching
+                        full entities. Projecting more than one property requires a composite index.
+                        Projection queries skip entities without an indexed value for every projected
+                        property, so the results can depend on the selected fields.
+    * cache_ttl - cache result pages (keys and cursors) in memcache for cache_ttl seconds, by query shape.
+                  Use graphene_gae.ndb.cache.invalidate_query_cache to invalidate a kind's cached pages.
+    * fetch_page - fetch each page (plus one lookahead result for hasNextPage) in a single batch
+                   instead of iterating the query one entity at a time. Per edge cursors are only
+                   computed when edges.cursor is selected.
+    * count_limit - when totalCount is selected, count up to count_limit results (default 1000)
+    * count_cache_ttl - cache totalCount in memcache for count_cache_ttl seconds, by query shape
+    * counter - a function(query) returning totalCount (or a future of it) instead of counting the
+                query - i.e. backed by a sharded counter
+    * counter_cache_key - identifies counter in count_cache_ttl cache keys (defaults to its module and name)
+    * retry_policy - a RetryPolicy for datastore timeouts while fetching a page (by default a Timeout is
+                     retried twice). Pages it cuts short are flagged with pageInfo.truncated.
+    '''
+    def __init__(self, type, transform_edges=None, fetch_by_keys=False, auto_projection=False, cache_ttl=None,
+                 fetch_page=False, count_limit=1000, count_cache_ttl=None, counter=None, counter_cache_key=None,
+                 retry_policy=None, *args, **kwargs):
         super(NdbConnectionField, self).__init__(
             type,
             *args,
@@ -107,6 +809,17 @@ class NdbConnectionField(ConnectionField):
         )
 
         self.transform_edges = transform_edges
+        self.connection_options = dict(
+            fetch_by_keys=fetch_by_keys,
+            auto_projection=auto_projection,
+            cache_ttl=cache_ttl,
+            fetch_page=fetch_page,
+            count_limit=count_limit,
+            count_cache_ttl=count_cache_ttl,
+            counter=counter,
+            counter_cache_key=counter_cache_key,
+            retry_policy=retry_policy
+        )
 
     @property
     def type(self):
@@ -123,24 +836,43 @@ class NdbConnectionField(ConnectionField):
         return self.type._meta.node._meta.model
 
     @staticmethod
-    def connection_resolver(resolver, connection, model, transform_edges, root, info, **args):
+    def connection_resolver(resolver, connection, model, transform_edges, connection_options, root, info, **args):
         ndb_query = resolver(root, info, **args)
         if ndb_query is None:
             ndb_query = model.query()
 
-        return connection_from_ndb_query(
+        use_projection = connection_options.get('auto_projection') and not (
+            transform_edges or connection_options.get('fetch_by_keys') or args.get('keys_only')
+        )
+        if use_projection:
+            selected_fields = get_selected_fields(info.field_asts, info.fragments, ('edges', 'node'))
+            projection = get_projection(ndb_query, connection._meta.node, selected_fields)
+            if projection:
+                connection_options = dict(connection_options, projection=projection)
+
+        if get_selected_fields(info.field_asts, info.fragments) & set(['totalCount', 'total_count']):
+            connection_options = dict(connection_options, total_count=True)
+
+        if connection_options.get('fetch_page'):
+            edge_fields = get_selected_fields(info.field_asts, info.fragments, ('edges',))
+            connection_options = dict(connection_options, edge_cursors='cursor' in edge_fields)
+
+        # Start fetching the page, but only block on it after sibling fields had the chance to start theirs
+        future = connection_from_ndb_query_async(
             ndb_query,
             args=args,
             connection_type=connection,
             edge_type=connection.Edge,
-            pageinfo_type=PageInfo,
+            pageinfo_type=NdbPageInfo,
             transform_edges=transform_edges,
-            context=info.context
+            context=info.context,
+            **connection_options
         )
+        return Promise.resolve(None).then(lambda _: future.get_result())
 
     def get_resolver(self, parent_resolver):
         return partial(
-            self.connection_resolver, parent_resolver, self.type, self.model, self.transform_edges
+            self.connection_resolver, parent_resolver, self.type, self.model, self.transform_edges, self.connection_options
         )
 
 
@@ -150,7 +882,7 @@ class DynamicNdbKeyStringField(Dynamic):
         if not registry:
             registry = get_global_registry()
 
-        def get_type():
+        def create_field():
             kind_name = kind if isinstance(kind, six.string_types) else kind.__name__
 
             _type = registry.get_type_for_model_name(kind_name)
@@ -159,6 +891,9 @@ class DynamicNdbKeyStringField(Dynamic):
 
             return NdbKeyStringField(ndb_key_prop, _type._meta.name)
 
+        def get_type():
+            return registry.get_dynamic_field(ndb_key_prop, 'key_string', create_field)
+
         super(DynamicNdbKeyStringField, self).__init__(
             get_type,
             *args, **kwargs
@@ -166,19 +901,23 @@ class DynamicNdbKeyStringField(Dynamic):
 
 
 class DynamicNdbKeyReferenceField(Dynamic):
-    def __init__(self, ndb_key_prop, registry=None, *args, **kwargs):
+    def __init__(self, ndb_key_prop, registry=None, use_async=False, *args, **kwargs):
         kind = ndb_key_prop._kind
         if not registry:
             registry = get_global_registry()
 
-        def get_type():
+        def create_field():
             kind_name = kind if isinstance(kind, six.string_types) else kind.__name__
 
             _type = registry.get_type_for_model_name(kind_name)
             if not _type:
                 return None
 
-            return NdbKeyReferenceField(ndb_key_prop, _type)
+            return NdbKeyReferenceField(ndb_key_prop, _type, use_async=use_async)
+
+        def get_type():
+            field_kind = 'async_key_reference' if use_async else 'key_reference'
+            return registry.get_dynamic_field(ndb_key_prop, field_kind, create_field)
 
         super(DynamicNdbKeyReferenceField, self).__init__(
             get_type,
@@ -186,6 +925,45 @@ class DynamicNdbKeyReferenceField(Dynamic):
         )
 
 
+# Maps ndb.Key => urlsafe string and (GraphQL type name, ndb.Key) => global id
+key_id_cache = LRUCache(max_size=10000)
+
+
+def key_urlsafe(key):
+    urlsafe = key_id_cache.get(key)
+    if urlsafe is None:
+        urlsafe = key.urlsafe()
+        key_id_cache.set(key, urlsafe)
+
+    return urlsafe
+
+
+def key_to_global_id(type_name, key):
+    return keys_to_global_ids(type_name, [key])[0]
+
+
+def keys_to_global_ids(type_name, keys):
+    '''
+    Returns the GraphQL global ids of the given ndb.Keys, encoding only the ones that aren't cached yet.
+    '''
+    cache_keys = [(type_name, key) for key in keys]
+    global_ids = key_id_cache.get_many(cache_keys)
+
+    missing = {}
+    for i, global_id in enumerate(global_ids):
+        if global_id is None:
+            cache_key = cache_keys[i]
+            if cache_key not in missing:
+                missing[cache_key] = to_global_id(type_name, cache_key[1].urlsafe())
+
+            global_ids[i] = missing[cache_key]
+
+    if missing:
+        key_id_cache.set_many(six.iteritems(missing))
+
+    return global_ids
+
+
 class NdbKeyStringField(Field):
     def __init__(self, ndb_key_prop, graphql_type_name, *args, **kwargs):
         self.__ndb_key_prop = ndb_key_prop
@@ -213,18 +991,25 @@ class NdbKeyStringField(Field):
             return None
 
         if isinstance(key_value, list):
-            return [to_global_id(self.__graphql_type_name, k.urlsafe()) for k in key_value] if is_global_id else [k.id() for k in key_value]
+            return keys_to_global_ids(self.__graphql_type_name, key_value) if is_global_id else [k.id() for k in key_value]
 
-        return to_global_id(self.__graphql_type_name, key_value.urlsafe()) if is_global_id else key_value.id()
+        return key_to_global_id(self.__graphql_type_name, key_value) if is_global_id else key_value.id()
 
     def get_resolver(self, parent_resolver):
         return self.resolve_key_to_string
 
 
 class NdbKeyReferenceField(Field):
-    def __init__(self, ndb_key_prop, graphql_type, *args, **kwargs):
+    '''
+    Resolves a KeyProperty to the entity (or entities) it points to.
+    By default lookups are batched through the request's NdbKeyLoader.
+    With use_async=True the resolver returns ndb.Futures instead, which requires
+    executing the schema with graphene_gae.ndb.executors.NdbExecutor.
+    '''
+    def __init__(self, ndb_key_prop, graphql_type, use_async=False, *args, **kwargs):
         self.__ndb_key_prop = ndb_key_prop
         self.__graphql_type = graphql_type
+        self.__use_async = use_async
         is_repeated = ndb_key_prop._repeated
         is_required = ndb_key_prop._required
 
@@ -242,10 +1027,17 @@ class NdbKeyReferenceField(Field):
         if not key_value:
             return None
 
+        if self.__use_async:
+            if isinstance(key_value, list):
+                return get_multi_tasklet(key_value)
+
+            return key_value.get_async()
+
+        loader = get_key_loader()
         if isinstance(key_value, list):
-            return ndb.get_multi(key_value)
+            return loader.load_many(key_value)
 
-        return key_value.get()
+        return loader.load(key_value)
 
     def get_resolver(self, parent_resolver):
         return self.resolve_key_reference
@@ -2,6 +2,8 @@ class Registry(object):
 
     def __init__(self):
         self._registry = {}
+        self._registry_by_model_name = {}
+        self._dynamic_fields = {}
 
     def register(self, cls):
         from .types import NdbObjectType
@@ -10,15 +12,43 @@ class Registry(object):
             'received "{}"'
         ).format(cls.__name__)
         assert cls._meta.registry == self, 'Registry for a Model have to match.'
-        self._registry[cls._meta.model] = cls
+
+        model = cls._meta.model
+        registered_type = self._registry_by_model_name.get(model.__name__)
+        assert registered_type is None or registered_type._meta.model is model, (
+            'Model {}.{} has the same name as the already registered {}.{}'
+        ).format(model.__module__, model.__name__, registered_type._meta.model.__module__, model.__name__)
+
+        self._registry[model] = cls
+        self._registry_by_model_name[model.__name__] = cls
+        self._dynamic_fields.clear()
+
+    def get_models(self):
+        return list(self._registry)
 
     def get_type_for_model(self, model):
         return self._registry.get(model)
 
     def get_type_for_model_name(self, model_name):
-        for ndb_model, type in self._registry.items():
-            if ndb_model.__name__ == model_name:
-                return type
+        return self._registry_by_model_name.get(model_name)
+
+    def get_dynamic_field(self, ndb_prop, field_kind, create_field):
+        '''
+        Returns the field of kind field_kind resolved for ndb_prop, calling create_field() when it isn't cached.
+        Nothing is cached while create_field() returns None (the type it refers to isn't registered yet),
+        and cached fields are dropped whenever a type is registered.
+        '''
+        # ndb.Property overloads == to build query filters, so properties are cached by identity
+        cache_key = (id(ndb_prop), field_kind)
+        cached = self._dynamic_fields.get(cache_key)
+        if cached is not None and cached[0] is ndb_prop:
+            return cached[1]
+
+        field = create_field()
+        if field is not None:
+            self._dynamic_fields[cache_key] = (ndb_prop, field)
+
+        return field
 
 
 registry = None
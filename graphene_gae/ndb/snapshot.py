@@ -0,0 +1,71 @@
+'''
+Schema snapshots save NdbObjectType the slow part of converting models at import time - naming the
+fields KeyProperties convert to, which imports inflect (see converter.get_key_field_names).
+
+Build the snapshot at deploy time, after importing the schema:
+
+    dump_schema_snapshot('schema_snapshot.json')
+
+and load it on instance startup (i.e. in appengine_config.py), before the schema's types are imported:
+
+    load_schema_snapshot('schema_snapshot.json')
+
+The names only depend on a KeyProperty's code name and whether it's repeated, so the snapshot doesn't
+go stale - KeyProperties it doesn't have are named from scratch. The rest of the conversion (a field
+per property) is cheap, so it isn't snapshotted.
+'''
+import json
+import logging
+
+from google.appengine.ext import ndb
+
+from .converter import get_key_field_names, snapshot_key_field_names
+from .registry import get_global_registry
+
+__author__ = 'ekampf'
+
+SNAPSHOT_VERSION = 2
+
+
+def build_schema_snapshot(registry=None):
+    registry = registry or get_global_registry()
+
+    key_field_names = set()
+    for model in registry.get_models():
+        for prop in model._properties.values():
+            if type(prop) is ndb.KeyProperty:
+                key_field_names.add((prop._code_name, prop._repeated, get_key_field_names(prop)))
+
+    return dict(version=SNAPSHOT_VERSION, key_field_names=sorted(key_field_names))
+
+
+def dump_schema_snapshot(path, registry=None):
+    with open(path, 'w') as f:
+        json.dump(build_schema_snapshot(registry), f, sort_keys=True)
+
+
+def load_schema_snapshot(path):
+    '''
+    Loads the key field names in the snapshot at path into converter.snapshot_key_field_names.
+    Returns whether the snapshot was loaded (missing or outdated snapshots are ignored).
+    '''
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (IOError, ValueError) as e:
+        logging.warning('Failed loading schema snapshot %s: %s', path, e)
+        return False
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        logging.warning('Ignoring schema snapshot %s of version %s', path, snapshot.get('version'))
+        return False
+
+    snapshot_key_field_names.update(
+        ((str(code_name), repeated), (str(id_name), str(reference_name)))
+        for code_name, repeated, (id_name, reference_name) in snapshot['key_field_names']
+    )
+    return True
+
+
+def clear_schema_snapshot():
+    snapshot_key_field_names.clear()
@@ -7,15 +7,19 @@ from graphene import Field, ID  # , annotate, ResolveInfo
 from graphene.relay import Connection, Node
 from graphene.types.objecttype import ObjectType, ObjectTypeOptions
 from graphene.types.utils import yank_fields_from_attrs
+from promise import Promise
 
 from .converter import convert_ndb_property
+from .fields import NdbConnection, get_key_loader, key_urlsafe
 from .registry import Registry, get_global_registry
 
 
 __author__ = 'ekampf'
 
 
-def fields_for_ndb_model(ndb_model, registry, only_fields, exclude_fields):
+def fields_for_ndb_model(ndb_model, registry, only_fields, exclude_fields, async_key_references=False, ndb_properties=None,
+                         key_field_names=None):
+    key_field_names = key_field_names or {}
     ndb_fields = OrderedDict()
     for prop_name, prop in ndb_model._properties.iteritems():
         name = prop._code_name
@@ -25,7 +29,9 @@ def fields_for_ndb_model(ndb_model, registry, only_fields, exclude_fields):
         if is_not_in_only or is_excluded:
             continue
 
-        results = convert_ndb_property(prop, registry)
+        results = convert_ndb_property(
+            prop, registry, async_key_references=async_key_references, key_field_names=key_field_names.get(name)
+        )
         if not results:
             continue
 
@@ -34,14 +40,33 @@ def fields_for_ndb_model(ndb_model, registry, only_fields, exclude_fields):
 
         for r in results:
             ndb_fields[r.name] = r.field
+            if ndb_properties is not None:
+                ndb_properties[r.name] = prop
 
     return ndb_fields
 
 
+_class_key_sets = {}
+
+
+def get_class_key_set(model):
+    '''
+    Returns a frozenset of a PolyModel class' _class_key() (None for other models), computed once per class.
+    '''
+    try:
+        return _class_key_sets[model]
+    except KeyError:
+        class_key = getattr(model, '_class_key', None)
+        class_key_set = _class_key_sets[model] = frozenset(class_key()) if class_key else None
+        return class_key_set
+
+
 class NdbObjectTypeOptions(ObjectTypeOptions):
     model = None  # type: Model
     registry = None  # type: Registry
     connection = None  # type: Type[Connection]
+    ndb_properties = None  # type: Dict[str, Property]
+    ndb_fields = None  # type: Dict[str, Field]
     id = None  # type: str
 
 
@@ -54,7 +79,8 @@ class NdbObjectType(ObjectType):
     @classmethod
     def __init_subclass_with_meta__(cls, model=None, registry=None, skip_registry=False,
                                     only_fields=(), exclude_fields=(), connection=None,
-                                    use_connection=None, interfaces=(), **options):
+                                    use_connection=None, interfaces=(), async_key_references=False,
+                                    key_field_names=None, **options):
 
         if not model:
             raise Exception((
@@ -74,7 +100,11 @@ class NdbObjectType(ObjectType):
             'Registry, received "{}".'
         ).format(cls.__name__, registry)
 
-        ndb_fields = fields_for_ndb_model(model, registry, only_fields, exclude_fields)
+        ndb_properties = {}
+        ndb_fields = fields_for_ndb_model(
+            model, registry, only_fields, exclude_fields, async_key_references, ndb_properties,
+            key_field_names=key_field_names
+        )
         ndb_fields = yank_fields_from_attrs(
             ndb_fields,
             _as=Field,
@@ -85,7 +115,7 @@ class NdbObjectType(ObjectType):
 
         if use_connection and not connection:
             # We create the connection automatically
-            connection = Connection.create_type('{}Connection'.format(cls.__name__), node=cls)
+            connection = NdbConnection.create_type('{}Connection'.format(cls.__name__), node=cls)
 
         if connection is not None:
             assert issubclass(connection, Connection), (
@@ -97,6 +127,9 @@ class NdbObjectType(ObjectType):
         _meta.registry = registry
         _meta.fields = ndb_fields
         _meta.connection = connection
+        _meta.ndb_properties = ndb_properties
+        # The fields converted from properties - ObjectType updates _meta.fields with the declared ones in place
+        _meta.ndb_fields = OrderedDict(ndb_fields)
 
         super(NdbObjectType, cls).__init_subclass_with_meta__(_meta=_meta, interfaces=interfaces, **options)
 
@@ -105,6 +138,10 @@ class NdbObjectType(ObjectType):
 
     @classmethod
     def is_type_of(cls, root, info):
+        root_type = type(root)
+        if root_type is cls._meta.model:
+            return True
+
         if isinstance(root, cls):
             return True
 
@@ -113,25 +150,28 @@ class NdbObjectType(ObjectType):
 
         # Returns True if `root` is a PolyModel subclass and `cls` is in the
         # class hierarchy of `root` which is retrieved with `_class_key`
-        if (hasattr(root, '_class_key') and
-            hasattr(cls._meta.model, '_class_key') and
-            set(cls._meta.model._class_key()).issubset(
-                set(root._class_key()))):
-            return True
-
-        return type(root) == cls._meta.model
+        model_class_key = get_class_key_set(cls._meta.model)
+        root_class_key = get_class_key_set(root_type)
+        return model_class_key is not None and root_class_key is not None and model_class_key <= root_class_key
 
     @classmethod
     def get_node(cls, info, urlsafe_key):
+        '''
+        Returns a promise of the entity, loaded through the request's NdbKeyLoader so that
+        the nodes requested together are fetched with a single ndb.get_multi_async call.
+        Invalid keys and keys of other kinds (or of other classes of a PolyModel hierarchy) resolve to None.
+        '''
         try:
             key = ndb.Key(urlsafe=urlsafe_key)
         except:
-            return None
+            return Promise.resolve(None)
 
         model = cls._meta.model
-        assert key.kind() == model.__name__
-        return key.get()
+        if key.kind() != model._get_kind():
+            return Promise.resolve(None)
+
+        return get_key_loader().load(key).then(lambda entity: entity if isinstance(entity, model) else None)
 
     @classmethod
     def resolve_id(cls, entity, info):
-        return entity.key.urlsafe()
+        return key_urlsafe(entity.key)
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+__author__ = 'ekampf'
+
+
+class LRUCache(object):
+    '''
+    A thread safe mapping holding up to max_size items, evicting the least recently used ones.
+    Meant for memoising pure functions across requests of the same instance.
+    '''
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+
+            self._items[key] = value
+            return value
+
+    def get_many(self, keys, default=None):
+        '''
+        Returns a list of the values of keys (default for missing ones), taking the lock once.
+        '''
+        values = []
+        with self._lock:
+            for key in keys:
+                try:
+                    value = self._items.pop(key)
+                except KeyError:
+                    values.append(default)
+                    continue
+
+                self._items[key] = value
+                values.append(value)
+
+        return values
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        with self._lock:
+            for key, value in items:
+                self._items.pop(key, None)
+                self._items[key] = value
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -1,14 +1,80 @@
+import hashlib
 import logging
 import json
 import webapp2
 import six
 
-from graphql import GraphQLError, format_error as format_graphql_error
+from google.appengine.api import memcache
+
+from graphql import GraphQLError, format_error as format_graphql_error, parse, validate
+from graphql.execution import ExecutionResult, execute
+from graphql.language.printer import print_ast
+from graphql.utils.get_operation_ast import get_operation_ast
+from promise import Promise
+
+from ..utils import LRUCache
+from .encoding import dumps, write_json
+from .persisted_queries import PersistedQueryNotFound, get_query_hash, get_persisted_query, get_registered_query
+from .persisted_queries import register_query, DEFAULT_REGISTERED_QUERY_TTL
 
 __author__ = 'ekampf'
 
+RESPONSE_CACHE_KEY_PREFIX = 'graphene_gae:response:'
+
+# Larger responses aren't cached - memcache rejects values over MAX_VALUE_SIZE (leaving room for the ETag and pickling)
+RESPONSE_CACHE_MAX_SIZE = memcache.MAX_VALUE_SIZE - 1024
+
+# Maps (id(schema), query) => (schema, document, errors)
+document_cache = LRUCache(max_size=500)
+
+
+def get_document(schema, query):
+    '''
+    Returns a (document, errors) tuple of the parsed and validated query, cached by schema and query text.
+    '''
+    cache_key = (id(schema), query)
+    cached = document_cache.get(cache_key)
+    if cached is not None and cached[0] is schema:
+        return cached[1], cached[2]
+
+    try:
+        document = parse(query)
+    except Exception as e:
+        document, errors = None, [e]
+    else:
+        errors = validate(schema, document)
+
+    document_cache.set(cache_key, (schema, document, errors))
+    return document, errors
+
 
 class GraphQLHandler(webapp2.RequestHandler):
+    '''
+    Executes GraphQL requests against the app's 'graphql_schema' config.
+    Parsed and validated queries are cached in process (see get_document).
+
+    Setting the 'graphql_response_cache_ttl' config (seconds) caches the responses of queries
+    (not mutations) without errors in memcache, by normalised query, operation name, variables
+    and _get_response_cache_scope(). Requests with credentials aren't cached unless a subclass scopes
+    them. Cached responses are served without executing the schema, as a 304 when they match
+    the request's If-None-Match. Responses too large for memcache (see RESPONSE_CACHE_MAX_SIZE) aren't cached.
+
+    Setting the 'graphql_persisted_queries' config supports (Apollo style) persisted queries - requests
+    may send extensions.persistedQuery.sha256Hash instead of the query. Unknown hashes get a 200 response
+    with a PersistedQueryNotFound error, and clients then send the query along with its hash to register it.
+    Valid queries clients send are registered in memcache for 'graphql_persisted_query_ttl' seconds
+    (a week by default, see graphene_gae.webapp2.persisted_queries.register_query).
+    With 'graphql_persisted_queries_only' only queries stored in advance (see
+    graphene_gae.webapp2.persisted_queries.persist_query) are executed.
+
+    POSTing a JSON array of operations executes them together and responds with an array of
+    their results. Operations are resolved side by side, so their key lookups share the request's
+    NdbKeyLoader batches. 'graphql_max_batch_size' limits the number of operations per request.
+
+    Setting the 'graphql_stream_responses' config encodes responses straight into the response stream
+    in chunks (see graphene_gae.webapp2.encoding.write_json) instead of into one string, roughly halving
+    the peak memory of large responses at the cost of encoding them in pure Python.
+    '''
     def get(self):
         return self._handle_request()
 
@@ -22,28 +88,101 @@ class GraphQLHandler(webapp2.RequestHandler):
         if not schema:
             webapp2.abort(500, detail='GraphQL Schema is missing.')
 
-        query, operation_name, variables, pretty_override = self._get_grapl_params()
+        batch = self._get_batch()
+        if batch is not None:
+            return self._handle_batch_request(schema, batch, pretty)
+
+        try:
+            query, operation_name, variables, pretty_override = self._get_grapl_params()
+        except PersistedQueryNotFound as e:
+            result = ExecutionResult(errors=[e], invalid=True)
+            return self.successful_response(self._get_result_response(result), pretty=pretty)
+
         pretty = pretty if not pretty_override else pretty_override
 
-        result = schema.execute(query,
-                                operation_name=operation_name,
-                                variable_values=variables,
-                                context_value=self._get_context(),
-                                root_value=self._get_root_value(),
-                                middleware=self._get_middleware())
+        document, errors = get_document(schema, query)
+
+        response_cache_key = None if errors else self._get_response_cache_key(document, operation_name, variables, pretty)
+        if response_cache_key:
+            cached_response = memcache.get(response_cache_key)
+            if cached_response:
+                return self.cached_response(*cached_response)
 
+        if errors:
+            result = ExecutionResult(errors=errors, invalid=True)
+        else:
+            result = self._execute(schema, document, operation_name, variables)
+
+        response = self._get_result_response(result)
+        if result.invalid:
+            logging.error("GraphQL request is invalid: %s", response)
+            return self.failed_response(400, response, pretty=pretty)
+
+        self.successful_response(response, pretty=pretty)
+
+        if response_cache_key and not result.errors:
+            self._cache_response(response_cache_key)
+
+    def _cache_response(self, response_cache_key):
+        # The response is already written, so responses memcache can't store are only logged
+        body = self.response.body
+        if len(body) > RESPONSE_CACHE_MAX_SIZE:
+            logging.info('Not caching GraphQL response of %d bytes', len(body))
+            return
+
+        try:
+            memcache.set(response_cache_key, (self.response.etag, body), time=self._get_response_cache_ttl())
+        except ValueError as e:
+            logging.warning('Failed caching GraphQL response: %s', e)
+
+    def _handle_batch_request(self, schema, batch, pretty):
+        max_batch_size = self._get_max_batch_size()
+        if not batch:
+            webapp2.abort(400, 'Batch is empty.')
+
+        if max_batch_size and len(batch) > max_batch_size:
+            webapp2.abort(400, 'Batch has more than {} operations.'.format(max_batch_size))
+
+        pretty_override = self.request.GET.get('pretty')
+        pretty = pretty if not pretty_override else pretty_override
+
+        operations = []
+        for request_data in batch:
+            if not isinstance(request_data, dict):
+                webapp2.abort(400, 'Batched operations must be objects.')
+
+            try:
+                query, operation_name, variables, _ = self._get_grapl_params(request_data)
+            except PersistedQueryNotFound as e:
+                operations.append((None, [e], None, None))
+                continue
+
+            document, errors = get_document(schema, query)
+            operations.append((document, errors, operation_name, variables))
+
+        def execute_operations(_):
+            # Executions started while the promise queue is being drained are queued rather than run
+            # to completion one by one, so the operations' fields are resolved side by side
+            return Promise.all([
+                Promise.resolve(ExecutionResult(errors=errors, invalid=True)) if errors else
+                self._execute(schema, document, operation_name, variables, return_promise=True)
+                for document, errors, operation_name, variables in operations
+            ])
+
+        results = Promise.resolve(None).then(execute_operations).get()
+        self.successful_response([self._get_result_response(result) for result in results], pretty=pretty)
+
+    def _get_result_response(self, result):
         response = {}
         if result.errors:
             response['errors'] = [self.__format_error(e) for e in result.errors]
             logging.warn("Request had errors: %s", response)
             self._handle_graphql_errors(result.errors)
 
-        if result.invalid:
-            logging.error("GraphQL request is invalid: %s", response)
-            return self.failed_response(400, response, pretty=pretty)
+        if not result.invalid:
+            response['data'] = result.data
 
-        response['data'] = result.data
-        return self.successful_response(response, pretty=pretty)
+        return response
 
     def handle_exception(self, exception, debug):
         logging.exception(exception)
@@ -59,30 +198,108 @@ class GraphQLHandler(webapp2.RequestHandler):
     def _handle_graphql_errors(self, result):
         pass
 
+    def _execute(self, schema, document, operation_name, variables, return_promise=False):
+        try:
+            return execute(schema, document,
+                           operation_name=operation_name,
+                           variable_values=variables or {},
+                           context_value=self._get_context(),
+                           root_value=self._get_root_value(),
+                           middleware=self._get_middleware(),
+                           return_promise=return_promise)
+        except Exception as e:
+            result = ExecutionResult(errors=[e], invalid=True)
+            return Promise.resolve(result) if return_promise else result
+
     def _get_schema(self):
         return self.app.config.get('graphql_schema')
 
     def _get_pretty(self):
         return self.app.config.get('graphql_pretty', False)
 
-    def _get_grapl_params(self):
+    def _get_response_cache_ttl(self):
+        return self.app.config.get('graphql_response_cache_ttl')
+
+    def _get_response_cache_scope(self):
+        '''
+        Returns who cached responses are shared with, or None to skip the cache.
+        By default anonymous requests share them and requests with credentials (a Cookie or Authorization
+        header) skip the cache, as their responses may be the user's own.
+        Override to cache those too (i.e. return the current user's id).
+        '''
+        if 'Cookie' in self.request.headers or 'Authorization' in self.request.headers:
+            return None
+
+        return ''
+
+    def _get_response_cache_key(self, document, operation_name, variables, pretty):
+        '''
+        Returns the memcache key of the response to the request, or None when it mustn't be cached.
+        '''
+        if not self._get_response_cache_ttl():
+            return None
+
+        operation = get_operation_ast(document, operation_name)
+        if not operation or operation.operation != 'query':
+            return None
+
+        scope = self._get_response_cache_scope()
+        if scope is None:
+            return None
+
+        cache_key = json.dumps(
+            [self.request.path, scope, print_ast(document), operation_name, variables, bool(pretty)], sort_keys=True
+        )
+        return RESPONSE_CACHE_KEY_PREFIX + hashlib.md5(cache_key.encode('utf-8')).hexdigest()
+
+    def _get_max_batch_size(self):
+        return self.app.config.get('graphql_max_batch_size')
+
+    def _get_stream_responses(self):
+        return self.app.config.get('graphql_stream_responses', False)
+
+    def _get_batch(self):
+        '''
+        Returns the list of operations (request data dicts) of a batched request, or None.
+        '''
+        if self.request.method != 'POST' or not self.request.body.lstrip().startswith(b'['):
+            return None
+
         try:
-            request_data = self.request.json_body
-            if isinstance(request_data, six.string_types):
-                request_data = dict(query=request_data)
-        except:
-            try:
-                request_data = json.loads(self.request.body)
-            except ValueError:
-                request_data = {}
+            batch = json.loads(self.request.body)
+        except ValueError:
+            return None
 
-        request_data.update(dict(self.request.GET))
+        return batch if isinstance(batch, list) else None
+
+    def _get_grapl_params(self, request_data=None):
+        body_query = None
+        if request_data is None:
+            try:
+                request_data = self.request.json_body
+                if isinstance(request_data, six.string_types):
+                    request_data = dict(query=request_data)
+            except:
+                try:
+                    request_data = json.loads(self.request.body)
+                except ValueError:
+                    request_data = {}
+
+            request_data.update(dict(self.request.GET))
+            body_query = self.request.body
+
+        query_hash = self._get_persisted_query_hash(request_data)
+        if query_hash:
+            query = self._get_persisted_query(query_hash, request_data.get('query'))
+        elif self._get_persisted_queries_only():
+            webapp2.abort(400, 'Only persisted queries are allowed.')
+        else:
+            query = request_data.get('query', body_query)
 
-        query = request_data.get('query', self.request.body)
         if not query:
             webapp2.abort(400, "Query is empty.")
 
-        operation_name = request_data.get('operation_name')
+        operation_name = request_data.get('operation_name') or request_data.get('operationName')
         variables = request_data.get('variables')
         if variables and isinstance(variables, six.text_type):
             try:
@@ -94,6 +311,54 @@ class GraphQLHandler(webapp2.RequestHandler):
 
         return query, operation_name, variables, pretty
 
+    def _get_persisted_queries(self):
+        return self.app.config.get('graphql_persisted_queries', False) or self._get_persisted_queries_only()
+
+    def _get_persisted_queries_only(self):
+        return self.app.config.get('graphql_persisted_queries_only', False)
+
+    def _get_persisted_query_ttl(self):
+        return self.app.config.get('graphql_persisted_query_ttl', DEFAULT_REGISTERED_QUERY_TTL)
+
+    def _get_persisted_query_hash(self, request_data):
+        if not self._get_persisted_queries():
+            return None
+
+        extensions = request_data.get('extensions')
+        if extensions and isinstance(extensions, six.string_types):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                webapp2.abort(400, 'Extensions are invalid JSON.')
+
+        persisted_query = (extensions or {}).get('persistedQuery') or {}
+        return persisted_query.get('sha256Hash')
+
+    def _get_persisted_query(self, query_hash, query=None):
+        persisted_query = get_persisted_query(query_hash)
+        if query is None:
+            if persisted_query is None and not self._get_persisted_queries_only():
+                persisted_query = get_registered_query(query_hash)
+
+            if persisted_query is None:
+                raise PersistedQueryNotFound()
+
+            return persisted_query
+
+        if get_query_hash(query) != query_hash:
+            webapp2.abort(400, 'Provided sha256Hash does not match query.')
+
+        if persisted_query is None:
+            if self._get_persisted_queries_only():
+                webapp2.abort(400, 'Only persisted queries are allowed.')
+
+            # Only valid queries are registered (get_document caches the result for executing the query)
+            document, errors = get_document(self._get_schema(), query)
+            if not errors:
+                register_query(query, ttl=self._get_persisted_query_ttl())
+
+        return query
+
     def _get_root_value(self):
         return None
 
@@ -107,24 +372,34 @@ class GraphQLHandler(webapp2.RequestHandler):
         if isinstance(error, GraphQLError):
             return format_graphql_error(error)
 
-        return {'message': str(error)}
-
-    def __json_encode(self, data, pretty=False):
-        if pretty:
-            return json.dumps(data, indent=2, sort_keys=True, separators=(',', ': '))
+        if isinstance(error, PersistedQueryNotFound):
+            return {'message': str(error), 'extensions': {'code': error.code}}
 
-        return json.dumps(data)
+        return {'message': str(error)}
 
     def successful_response(self, data, pretty=False):
-        serialized_data = self.__json_encode(data, pretty=pretty)
-
         self.response.set_status(200, 'Success')
+        self.response.content_type = 'application/json'
+
+        if self._get_stream_responses():
+            self.response.etag = write_json(self.response.out, data, pretty=pretty)
+            return
+
+        self.response.out.write(dumps(data, pretty=pretty))
         self.response.md5_etag()
+
+    def cached_response(self, etag, body):
         self.response.content_type = 'application/json'
-        self.response.out.write(serialized_data)
+        self.response.etag = etag
+        if etag in self.request.if_none_match:
+            self.response.set_status(304)
+            return
+
+        self.response.set_status(200, 'Success')
+        self.response.out.write(body)
 
     def failed_response(self, error_code, data, pretty=False):
-        serialized_data = self.__json_encode(data, pretty=pretty)
+        serialized_data = dumps(data, pretty=pretty)
 
         self.response.set_status(error_code)
         self.response.content_type = 'application/json'
@@ -0,0 +1,86 @@
+'''
+JSON encoding of GraphQL responses.
+
+The JSON module responses are encoded with is chosen on import - simplejson when it's installed, json otherwise.
+set_backend switches it (i.e. to 'ujson', which is faster but has no streaming encoder and rounds floats).
+'''
+import base64
+import hashlib
+import importlib
+import json
+
+__author__ = 'ekampf'
+
+DEFAULT_BACKENDS = ('simplejson', 'json')
+
+# How much encoded JSON write_json buffers before writing it out
+CHUNK_SIZE = 8 * 1024
+
+
+def load_backend(names=DEFAULT_BACKENDS):
+    for name in names:
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            continue
+
+    raise ImportError('None of the JSON backends {} is installed'.format(', '.join(names)))
+
+
+backend = load_backend()
+
+
+def set_backend(name):
+    global backend
+    backend = importlib.import_module(name)
+
+
+def get_encoder(pretty=False):
+    # Backends without an encoder class (ujson) stream with the json module's
+    encoder_class = getattr(backend, 'JSONEncoder', json.JSONEncoder)
+    if pretty:
+        return encoder_class(indent=2, sort_keys=True, separators=(',', ': '))
+
+    return encoder_class()
+
+
+def dumps(data, pretty=False):
+    if pretty:
+        return get_encoder(pretty=True).encode(data)
+
+    return backend.dumps(data)
+
+
+def write_json(out, data, pretty=False, chunk_size=CHUNK_SIZE):
+    '''
+    Encodes data into the file like object out in chunks of about chunk_size, without building the whole
+    document in memory first. Returns the document's md5 ETag (same as webob's Response.md5_etag).
+    '''
+    md5 = hashlib.md5()
+    buffered = []
+    buffered_size = 0
+
+    def flush():
+        chunk = ''.join(buffered)
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+
+        md5.update(chunk)
+        out.write(chunk)
+        del buffered[:]
+
+    for chunk in get_encoder(pretty).iterencode(data):
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= chunk_size:
+            flush()
+            buffered_size = 0
+
+    if buffered:
+        flush()
+
+    etag = base64.b64encode(md5.digest())
+    if not isinstance(etag, str):
+        etag = etag.decode('ascii')
+
+    return etag.strip('=')
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+
+import six
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from ..utils import LRUCache
+
+__author__ = 'ekampf'
+
+REGISTERED_QUERY_KEY_PREFIX = 'graphene_gae:registered_query:'
+
+# How long (seconds) queries registered by clients are kept for by default
+DEFAULT_REGISTERED_QUERY_TTL = 7 * 24 * 60 * 60
+
+
+class PersistedQueryNotFound(Exception):
+    '''
+    Raised for hashes of queries that aren't stored. It's reported (as a GraphQL error with the
+    PERSISTED_QUERY_NOT_FOUND code) in a 200 response, which Apollo clients retry with the query.
+    '''
+    code = 'PERSISTED_QUERY_NOT_FOUND'
+
+    def __init__(self):
+        super(PersistedQueryNotFound, self).__init__('PersistedQueryNotFound')
+
+
+class GraphQLPersistedQuery(ndb.Model):
+    '''
+    A GraphQL document stored under its sha256 hash (the entity's id).
+    Entities are cached in memcache by NDB, and in process by get_persisted_query.
+    '''
+    query = ndb.TextProperty(required=True)
+    created_at = ndb.DateTimeProperty(auto_now_add=True)
+
+
+persisted_query_cache = LRUCache(max_size=1000)
+
+
+def get_query_hash(query):
+    if isinstance(query, six.text_type):
+        query = query.encode('utf-8')
+
+    return hashlib.sha256(query).hexdigest()
+
+
+def get_persisted_query(query_hash):
+    '''
+    Returns the query stored under query_hash, or None.
+    '''
+    query = persisted_query_cache.get(query_hash)
+    if query is None:
+        persisted_query = GraphQLPersistedQuery.get_by_id(query_hash)
+        if persisted_query is None:
+            return None
+
+        query = persisted_query.query
+        persisted_query_cache.set(query_hash, query)
+
+    return query
+
+
+def persist_query(query):
+    '''
+    Stores query (i.e. when whitelisting the queries of a client release) and returns its hash.
+    '''
+    query_hash = get_query_hash(query)
+    if get_persisted_query(query_hash) is None:
+        GraphQLPersistedQuery(id=query_hash, query=query).put()
+        persisted_query_cache.set(query_hash, query)
+
+    return query_hash
+
+
+def get_registered_query(query_hash):
+    '''
+    Returns the query a client registered under query_hash (see register_query), or None.
+    '''
+    return memcache.get(REGISTERED_QUERY_KEY_PREFIX + query_hash)
+
+
+def register_query(query, ttl=DEFAULT_REGISTERED_QUERY_TTL):
+    '''
+    Stores a (valid) query sent by a client for ttl seconds and returns its hash.
+    Unlike persist_query, registered queries are kept in memcache only, so they expire (or get evicted).
+    '''
+    query_hash = get_query_hash(query)
+    try:
+        memcache.set(REGISTERED_QUERY_KEY_PREFIX + query_hash, query, time=ttl)
+    except ValueError as e:
+        logging.warning('Failed registering persisted query %s: %s', query_hash, e)
+
+    return query_hash
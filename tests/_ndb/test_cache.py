@@ -0,0 +1,56 @@
+from tests.base_test import BaseTest
+
+from google.appengine.api import namespace_manager
+
+from graphene_gae.ndb.cache import query_shape_cache_key, get_cached_query_result, set_cached_query_result, invalidate_query_cache
+
+from tests.models import Article, Comment
+
+__author__ = 'ekampf'
+
+
+class TestQueryCache(BaseTest):
+
+    def testQueryShapeCacheKey_sameShape_sameKey(self):
+        key = query_shape_cache_key(Article.query(Article.headline == 'a'), first=2)
+        self.assertEqual(key, query_shape_cache_key(Article.query(Article.headline == 'a'), first=2))
+
+    def testQueryShapeCacheKey_differentShape_differentKey(self):
+        key = query_shape_cache_key(Article.query(Article.headline == 'a'), first=2)
+        self.assertNotEqual(key, query_shape_cache_key(Article.query(Article.headline == 'b'), first=2))
+        self.assertNotEqual(key, query_shape_cache_key(Article.query(Article.headline == 'a'), first=3))
+        self.assertNotEqual(key, query_shape_cache_key(Article.query(Article.headline == 'a').order(Article.headline), first=2))
+
+        namespace_manager.set_namespace('other')
+        try:
+            self.assertNotEqual(key, query_shape_cache_key(Article.query(Article.headline == 'a'), first=2))
+        finally:
+            namespace_manager.set_namespace('')
+
+    def testGetCachedQueryResult(self):
+        query = Article.query()
+        cache_key = query_shape_cache_key(query)
+
+        generation, value = get_cached_query_result(query, cache_key)
+        self.assertIsNone(value)
+
+        set_cached_query_result(cache_key, generation, 'value', 60)
+        self.assertEqual(get_cached_query_result(query, cache_key), (generation, 'value'))
+
+    def testInvalidateQueryCache_invalidatesKind(self):
+        article_query = Article.query()
+        article_cache_key = query_shape_cache_key(article_query)
+        comment_query = Comment.query()
+        comment_cache_key = query_shape_cache_key(comment_query)
+
+        generation, _ = get_cached_query_result(article_query, article_cache_key)
+        set_cached_query_result(article_cache_key, generation, 'article', 60)
+        generation, _ = get_cached_query_result(comment_query, comment_cache_key)
+        set_cached_query_result(comment_cache_key, generation, 'comment', 60)
+
+        invalidate_query_cache(Article)
+
+        _, value = get_cached_query_result(article_query, article_cache_key)
+        self.assertIsNone(value)
+        _, value = get_cached_query_result(comment_query, comment_cache_key)
+        self.assertEqual(value, 'comment')
@@ -11,7 +11,7 @@ from graphene.types.json import JSONString
 from graphene.types.datetime import DateTime, Time
 
 from graphene_gae.ndb.fields import NdbKeyStringField, NdbKeyReferenceField, DynamicNdbKeyStringField, DynamicNdbKeyReferenceField
-from graphene_gae.ndb.converter import convert_ndb_property
+from graphene_gae.ndb.converter import convert_ndb_property, get_key_field_names, derive_key_field_names, key_field_names_cache
 from graphene_gae.ndb.registry import Registry
 
 __author__ = 'ekampf'
@@ -214,3 +214,77 @@ class TestNDBConverter(BaseTest):
         _type = conversion[1].field.get_type()
         self.assertIsInstance(_type, NdbKeyReferenceField)
         self.assertEqual(_type._type, UserType)
+
+    def testKeyProperty_fieldNamesCached(self):
+        key_field_names_cache.clear()
+        prop = ndb.KeyProperty(kind='Tag', repeated=True)
+        prop._code_name = 'tags'
+
+        with mock.patch('graphene_gae.ndb.converter.derive_key_field_names', wraps=derive_key_field_names) as derive:
+            self.assertEqual(get_key_field_names(prop), ('tag_ids', 'tags'))
+            self.assertEqual(get_key_field_names(prop), ('tag_ids', 'tags'))
+
+        derive.assert_called_once_with('tags', True)
+
+    def testKeyProperty_withSuffix_doesntNeedInflect(self):
+        with mock.patch('graphene_gae.ndb.converter.get_inflect_engine') as get_inflect_engine:
+            self.assertEqual(derive_key_field_names('user_key', False), ('user_id', 'user'))
+
+        self.assertFalse(get_inflect_engine.called)
+
+    def testKeyProperty_fieldNames_overridden(self):
+        prop = ndb.KeyProperty(kind='User')
+        prop._code_name = 'owner_key'
+
+        with mock.patch('graphene_gae.ndb.converter.get_key_field_names') as get_key_field_names:
+            conversion = convert_ndb_property(prop, Registry(), key_field_names=('owner_id', 'owned_by'))
+
+        self.assertFalse(get_key_field_names.called)
+        self.assertEqual([c.name for c in conversion], ['owner_id', 'owned_by'])
+
+    def testKeyProperty_dynamicTypeCachedPerRegistry(self):
+        my_registry = Registry()
+
+        class User(ndb.Model):
+            name = ndb.StringProperty()
+
+        prop = ndb.KeyProperty(kind='User')
+        prop._code_name = 'user_key'
+
+        conversion = convert_ndb_property(prop, my_registry)
+        self.assertIsNone(conversion[1].field.get_type())
+
+        class UserType(NdbObjectType):
+            class Meta:
+                model = User
+                registry = my_registry
+
+        _type = conversion[1].field.get_type()
+        self.assertIsInstance(_type, NdbKeyReferenceField)
+        self.assertIs(conversion[1].field.get_type(), _type)
+
+        # Another conversion of the same property in the same registry reuses the field
+        other_conversion = convert_ndb_property(prop, my_registry)
+        self.assertIs(other_conversion[1].field.get_type(), _type)
+        self.assertIs(other_conversion[0].field.get_type(), conversion[0].field.get_type())
+
+        self.assertIsNot(convert_ndb_property(prop, Registry())[1].field.get_type(), _type)
+
+    def testStructuredProperty_dynamicTypeCached(self):
+        my_registry = Registry()
+
+        class Location(ndb.Model):
+            street = ndb.StringProperty()
+
+        class LocationType(NdbObjectType):
+            class Meta:
+                model = Location
+                registry = my_registry
+
+        prop = ndb.StructuredProperty(Location, repeated=True)
+        prop._code_name = 'locations'
+
+        field = convert_ndb_property(prop, my_registry).field
+        _type = field.get_type()
+        self.assertEqual(_type._type, List(LocationType))
+        self.assertIs(field.get_type(), _type)
@@ -0,0 +1,84 @@
+from tests.base_test import BaseTest
+
+from google.appengine.ext import ndb
+
+import graphene
+from graphene_gae import NdbObjectType
+from graphene_gae.ndb.executors import NdbExecutor
+from graphene_gae.ndb.registry import Registry
+
+from tests.models import Article, Author, Tag
+
+__author__ = 'ekampf'
+
+
+async_registry = Registry()
+
+
+class AuthorType(NdbObjectType):
+    class Meta:
+        model = Author
+        registry = async_registry
+
+
+class TagType(NdbObjectType):
+    class Meta:
+        model = Tag
+        registry = async_registry
+
+
+class ArticleType(NdbObjectType):
+    class Meta:
+        model = Article
+        registry = async_registry
+        async_key_references = True
+
+
+class QueryRoot(graphene.ObjectType):
+    articles = graphene.List(ArticleType)
+
+    def resolve_articles(self, info):
+        return Article.query().order(Article.headline).fetch()
+
+
+schema = graphene.Schema(query=QueryRoot)
+
+
+class TestNdbExecutor(BaseTest):
+
+    def testAsyncKeyReference_resolvesToFuture(self):
+        author_key = Author(name="John Dow", email="john@dow.com").put()
+        article = Article(headline="Test1", author_key=author_key)
+
+        field = ArticleType._meta.fields['author'].get_type()
+        result = field.get_resolver(None)(article, None)
+
+        self.assertIsInstance(result, ndb.Future)
+        self.assertEqual(result.get_result().name, "John Dow")
+
+    def testAsyncKeyReferences_resolvedByNdbExecutor(self):
+        author_key = Author(name="John Dow", email="john@dow.com").put()
+        tag_keys = [Tag(name="tag1").put(), Tag(name="tag2").put()]
+        Article(headline="Test1", author_key=author_key, tags=tag_keys).put()
+        Article(headline="Test2", tags=tag_keys[:1]).put()
+
+        result = schema.execute("""
+            query Articles {
+                articles {
+                    headline,
+                    author { name },
+                    tags { name }
+                }
+            }
+            """, executor=NdbExecutor())
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+
+        articles = result.data['articles']
+        self.assertLength(articles, 2)
+
+        self.assertEqual(articles[0]['author'], {'name': 'John Dow'})
+        self.assertListEqual([t['name'] for t in articles[0]['tags']], ['tag1', 'tag2'])
+
+        self.assertIsNone(articles[1]['author'])
+        self.assertListEqual([t['name'] for t in articles[1]['tags']], ['tag1'])
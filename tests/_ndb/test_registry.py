@@ -0,0 +1,57 @@
+from tests.base_test import BaseTest
+
+from google.appengine.ext import ndb
+
+from graphene_gae import NdbObjectType
+from graphene_gae.ndb.registry import Registry
+
+from tests.models import Article
+
+__author__ = 'ekampf'
+
+
+class TestRegistry(BaseTest):
+
+    def testGetTypeForModelName(self):
+        my_registry = Registry()
+
+        class ArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                registry = my_registry
+
+        self.assertEqual(my_registry.get_type_for_model_name('Article'), ArticleType)
+        self.assertEqual(my_registry.get_type_for_model(Article), ArticleType)
+        self.assertIsNone(my_registry.get_type_for_model_name('Comment'))
+
+    def testRegister_sameModelTwice_lastTypeWins(self):
+        my_registry = Registry()
+
+        class ArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                registry = my_registry
+
+        class OtherArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                registry = my_registry
+
+        self.assertEqual(my_registry.get_type_for_model_name('Article'), OtherArticleType)
+
+    def testRegister_differentModelWithSameName_raises(self):
+        my_registry = Registry()
+
+        class ArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                registry = my_registry
+
+        # A model named Article (stored under a different kind) from another module
+        other_article = type('Article', (ndb.Model,), {'_get_kind': classmethod(lambda cls: 'OtherArticle')})
+
+        with self.assertRaises(AssertionError):
+            class OtherArticleType(NdbObjectType):
+                class Meta:
+                    model = other_article
+                    registry = my_registry
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from tests.base_test import BaseTest
+
+from google.appengine.ext import ndb
+
+from graphene_gae import NdbObjectType
+from graphene_gae.ndb.converter import get_key_field_names, key_field_names_cache
+from graphene_gae.ndb.registry import Registry
+from graphene_gae.ndb.snapshot import build_schema_snapshot, dump_schema_snapshot, load_schema_snapshot
+from graphene_gae.ndb.snapshot import clear_schema_snapshot, SNAPSHOT_VERSION
+
+from tests.models import Article
+
+__author__ = 'ekampf'
+
+
+class TestSchemaSnapshot(BaseTest):
+
+    def setUp(self):
+        super(TestSchemaSnapshot, self).setUp()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.snapshot_dir, 'schema_snapshot.json')
+
+        self.registry = Registry()
+
+        class ArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                registry = self.registry
+
+    def tearDown(self):
+        clear_schema_snapshot()
+        shutil.rmtree(self.snapshot_dir)
+        super(TestSchemaSnapshot, self).tearDown()
+
+    def testBuildSchemaSnapshot(self):
+        snapshot = build_schema_snapshot(self.registry)
+
+        self.assertEqual(snapshot['key_field_names'], [
+            ('author_key', False, ('author_id', 'author')),
+            ('tags', True, ('tag_ids', 'tags')),
+        ])
+
+    def testLoadSchemaSnapshot_skipsKeyFieldNameDerivation(self):
+        dump_schema_snapshot(self.snapshot_path, self.registry)
+        key_field_names_cache.clear()
+        self.assertTrue(load_schema_snapshot(self.snapshot_path))
+
+        other_registry = Registry()
+        with mock.patch('graphene_gae.ndb.converter.derive_key_field_names') as derive_key_field_names:
+            class ArticleType(NdbObjectType):
+                class Meta:
+                    model = Article
+                    registry = other_registry
+
+        self.assertFalse(derive_key_field_names.called)
+        self.assertIn('author_id', ArticleType._meta.fields)
+        self.assertIn('tag_ids', ArticleType._meta.fields)
+
+    def testLoadSchemaSnapshot_largerThanCache_keepsAllNames(self):
+        count = key_field_names_cache.max_size + 10
+        with open(self.snapshot_path, 'w') as f:
+            json.dump(dict(version=SNAPSHOT_VERSION, key_field_names=[
+                ('store%s' % i, False, ('store%s_id' % i, 'store%s' % i)) for i in range(count)
+            ]), f)
+
+        key_field_names_cache.clear()
+        self.assertTrue(load_schema_snapshot(self.snapshot_path))
+
+        with mock.patch('graphene_gae.ndb.converter.derive_key_field_names') as derive_key_field_names:
+            for i in range(count):
+                prop = ndb.KeyProperty('store%s' % i)
+                prop._code_name = 'store%s' % i
+                self.assertEqual(get_key_field_names(prop), ('store%s_id' % i, 'store%s' % i))
+
+        self.assertFalse(derive_key_field_names.called)
+
+    def testLoadSchemaSnapshot_otherVersion_returnsFalse(self):
+        with open(self.snapshot_path, 'w') as f:
+            json.dump(dict(version=1, models={}), f)
+
+        self.assertFalse(load_schema_snapshot(self.snapshot_path))
+
+    def testLoadSchemaSnapshot_missingFile_returnsFalse(self):
+        self.assertFalse(load_schema_snapshot(self.snapshot_path))
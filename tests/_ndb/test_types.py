@@ -5,7 +5,7 @@ from tests.base_test import BaseTest
 import graphene
 
 from graphene_gae import NdbObjectType
-from tests.models import Tag, Comment, Article, Address, Author, PhoneNumber
+from tests.models import Tag, Comment, Article, Address, Author, PhoneNumber, Animal, Dog
 
 __author__ = 'ekampf'
 
@@ -41,6 +41,16 @@ class ArticleType(NdbObjectType):
         exclude_fields = ['to_be_excluded']
 
 
+class AnimalType(NdbObjectType):
+    class Meta:
+        model = Animal
+
+
+class DogType(NdbObjectType):
+    class Meta:
+        model = Dog
+
+
 class QueryRoot(graphene.ObjectType):
     articles = graphene.List(ArticleType)
 
@@ -58,6 +68,33 @@ class TestNDBTypes(BaseTest):
         h = ArticleType(**instance.to_dict(exclude=["tags", "author_key"]))
         self.assertEqual(instance.headline, h.headline)
 
+    def testNdbObjectType_keyFieldNames_overrideDerivedNames(self):
+        class RenamedArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                skip_registry = True
+                key_field_names = {'author_key': ('writer_id', 'writer')}
+
+        fields = RenamedArticleType._meta.fields
+        self.assertIn('writer_id', fields)
+        self.assertIn('writer', fields)
+        self.assertNotIn('author_id', fields)
+        self.assertIn('tag_ids', fields)
+
+    def testNdbObjectType_isTypeOf(self):
+        self.assertTrue(ArticleType.is_type_of(Article(headline="test"), None))
+        self.assertFalse(ArticleType.is_type_of(Comment(), None))
+
+        with self.assertRaises(Exception):
+            ArticleType.is_type_of(object(), None)
+
+    def testNdbObjectType_isTypeOf_polyModel(self):
+        self.assertTrue(AnimalType.is_type_of(Animal(), None))
+        self.assertTrue(AnimalType.is_type_of(Dog(), None))
+        self.assertTrue(DogType.is_type_of(Dog(), None))
+        self.assertFalse(DogType.is_type_of(Animal(), None))
+        self.assertFalse(ArticleType.is_type_of(Dog(), None))
+
     def testNdbObjectType_should_raise_if_no_model(self):
         with self.assertRaises(Exception) as context:
             class Character1(NdbObjectType):
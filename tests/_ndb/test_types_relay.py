@@ -1,11 +1,22 @@
+from functools import partial
+
+import mock
+
 from tests.base_test import BaseTest
 
+from google.appengine.datastore import datastore_query
 from google.appengine.ext import ndb
+from google.appengine.ext.db import Timeout
 
 import graphene
 from graphene.relay import Node
+from graphql_relay import to_global_id
 from graphene_gae import NdbObjectType
-from graphene_gae.ndb.fields import NdbConnectionField
+from graphene_gae.ndb.cache import invalidate_query_cache
+from graphene_gae.ndb.fields import NdbConnectionField, LazyCursor, get_projection, batch_cursor
+from graphene_gae.ndb.fields import connection_from_ndb_query, connection_from_ndb_query_async, generate_edges_page
+from graphene_gae.ndb.fields import RetryPolicy, count_query_async, get_counter_cache_key, parse_cursor, reverse_query
+from graphene_gae.ndb.fields import key_id_cache, keys_to_global_ids
 
 from tests.models import Tag, Comment, Article, Author, Address, PhoneNumber, Reader, ArticleReader
 
@@ -80,7 +91,15 @@ class ArticleType(NdbObjectType):
 
 
 class QueryRoot(graphene.ObjectType):
+    node = Node.Field()
     articles = NdbConnectionField(ArticleType)
+    articles_by_keys = NdbConnectionField(ArticleType, fetch_by_keys=True)
+    articles_projected = NdbConnectionField(ArticleType, auto_projection=True)
+    cached_articles = NdbConnectionField(ArticleType, cache_ttl=60)
+    paged_articles = NdbConnectionField(ArticleType, fetch_page=True)
+    limited_count_articles = NdbConnectionField(ArticleType, count_limit=2)
+    counted_articles = NdbConnectionField(ArticleType, counter=lambda query: 42)
+    deadline_articles = NdbConnectionField(ArticleType, retry_policy=RetryPolicy(deadline=0))
 
 
 schema = graphene.Schema(query=QueryRoot)
@@ -89,12 +108,17 @@ schema = graphene.Schema(query=QueryRoot)
 class TestNDBTypesRelay(BaseTest):
 
     def testNdbNode_getNode_invalidId_shouldReturnNone(self):
-        result = ArticleType.get_node(None, "I'm not a valid NDB encoded key")
+        result = ArticleType.get_node(None, "I'm not a valid NDB encoded key").get()
         self.assertIsNone(result)
 
     def testNdbNode_getNode_validID_entityDoesntExist_shouldReturnNone(self):
         article_key = ndb.Key('Article', 'invalid_id_thats_not_in_db')
-        result = ArticleType.get_node(None, article_key.urlsafe())
+        result = ArticleType.get_node(None, article_key.urlsafe()).get()
+        self.assertIsNone(result)
+
+    def testNdbNode_getNode_keyOfOtherKind_shouldReturnNone(self):
+        comment_key = Comment(body="TestGetNode").put()
+        result = ArticleType.get_node(None, comment_key.urlsafe()).get()
         self.assertIsNone(result)
 
     def testNdbNode_getNode_validID_entityDoes_shouldReturnEntity(self):
@@ -104,7 +128,7 @@ class TestNDBTypesRelay(BaseTest):
             author_key=Author(name="John Dow", email="john@dow.com").put(),
         ).put()
 
-        result = ArticleType.get_node(None, article_key.urlsafe())
+        result = ArticleType.get_node(None, article_key.urlsafe()).get()
         article = article_key.get()
 
         self.assertIsNotNone(result)
@@ -112,6 +136,22 @@ class TestNDBTypesRelay(BaseTest):
         self.assertEqual(result.summary, article.summary)
         # self.assertEqual(result.author_key, article_key.author_key)  # TODO
 
+    def testNdbNode_nodeField_batchesLookups(self):
+        article_keys = [Article(headline="Test%s" % i, summary=str(i)).put() for i in range(2)]
+
+        with mock.patch.object(ndb, 'get_multi_async', wraps=ndb.get_multi_async) as get_multi_async:
+            result = schema.execute("""
+                query Nodes {
+                    first: node(id: "%s") { ... on ArticleType { headline } }
+                    second: node(id: "%s") { ... on ArticleType { headline } }
+                }
+            """ % tuple(to_global_id('ArticleType', key.urlsafe()) for key in article_keys))
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertEqual(result.data['first']['headline'], 'Test0')
+        self.assertEqual(result.data['second']['headline'], 'Test1')
+        self.assertEqual(get_multi_async.call_count, 1)
+
     def test_keyProperty(self):
         Article(
             headline="Test1",
@@ -158,6 +198,40 @@ class TestNDBTypesRelay(BaseTest):
         tag_names = [t['name'] for t in tags]
         self.assertListEqual(tag_names, ['tag1', 'tag2', 'tag3'])
 
+    def test_keyProperty_batchesKeyLookups(self):
+        author_key = Author(name="John Dow", email="john@dow.com").put()
+        tag_keys = [Tag(name="tag1").put(), Tag(name="tag2").put()]
+        for i in range(3):
+            Article(headline="Test%s" % i, author_key=author_key, tags=tag_keys).put()
+
+        ndb.get_context().clear_cache()
+        with mock.patch.object(ndb, 'get_multi_async', wraps=ndb.get_multi_async) as get_multi_async:
+            result = schema.execute("""
+                query Articles {
+                    articles {
+                        edges {
+                            node {
+                                author { name },
+                                tags { name }
+                            }
+                        }
+                    }
+                }
+                """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+
+        articles = result.data.get('articles', {}).get('edges', [])
+        self.assertLength(articles, 3)
+        for article in articles:
+            self.assertEqual(article['node']['author']['name'], 'John Dow')
+            self.assertListEqual([t['name'] for t in article['node']['tags']], ['tag1', 'tag2'])
+
+        self.assertEqual(get_multi_async.call_count, 1)
+        fetched_keys = get_multi_async.call_args[0][0]
+        self.assertLength(fetched_keys, 3)
+        self.assertEqual(set(fetched_keys), set([author_key] + tag_keys))
+
     def test_connectionField(self):
         a1 = Article(headline="Test1", summary="1").put()
         a2 = Article(headline="Test2", summary="2").put()
@@ -233,6 +307,634 @@ class TestNDBTypesRelay(BaseTest):
         articles = result.data.get('articles', {}).get('edges')
         self.assertLength(articles, 3)
 
+    def test_connectionField_fetchByKeys(self):
+        article_keys = [Article(headline="Test%s" % i, summary=str(i)).put() for i in range(3)]
+        article_keys[1].delete()
+
+        with mock.patch.object(ndb, 'get_multi_async', wraps=ndb.get_multi_async) as get_multi_async:
+            result = schema.execute("""
+                query Articles {
+                    articlesByKeys {
+                        edges {
+                            cursor,
+                            node {
+                                headline,
+                                summary
+                            }
+                        }
+                    }
+                }
+                """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+
+        articles = result.data.get('articlesByKeys', {}).get('edges')
+        self.assertLength(articles, 2)
+        self.assertListEqual([a['node']['headline'] for a in articles], ['Test0', 'Test2'])
+        for article in articles:
+            self.assertIsNotNone(article['cursor'])
+
+        get_multi_async.assert_called_once_with([article_keys[0], article_keys[2]])
+
+    def test_connectionField_autoProjection(self):
+        Article(headline="Test1", summary="1").put()
+        Article(headline="Test2", summary="2").put()
+
+        with mock.patch.object(ndb.Query, 'iter', autospec=True, side_effect=ndb.Query.iter) as query_iter:
+            result = schema.execute("""
+                query Articles {
+                    articlesProjected {
+                        edges {
+                            cursor,
+                            node {
+                                id,
+                                ...ArticleHeadline
+                            }
+                        }
+                    }
+                }
+
+                fragment ArticleHeadline on ArticleType {
+                    headline
+                }
+                """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+
+        articles = result.data.get('articlesProjected', {}).get('edges')
+        self.assertListEqual([a['node']['headline'] for a in articles], ['Test1', 'Test2'])
+        for article in articles:
+            self.assertIsNotNone(article['node']['id'])
+
+        self.assertEqual(query_iter.call_count, 1)
+        self.assertEqual(query_iter.call_args[1]['projection'], ('headline',))
+
+    def test_getProjection(self):
+        query = Article.query()
+        self.assertEqual(get_projection(query, ArticleType, {'id', 'headline'}), ('headline',))
+        self.assertEqual(get_projection(query, ArticleType, {'headline', 'authorId', 'createdAt'}), ('author_key', 'created_at', 'headline'))
+
+    def test_getProjection_unprojectableFields_returnsNone(self):
+        query = Article.query()
+        self.assertIsNone(get_projection(query, ArticleType, {'id'}))
+        self.assertIsNone(get_projection(query, ArticleType, {'headline', 'body'}))
+        self.assertIsNone(get_projection(query, ArticleType, {'headline', 'keywords'}))
+        self.assertIsNone(get_projection(query, ArticleType, {'headline', 'comments'}))
+        self.assertIsNone(get_projection(Article.query(Article.headline == 'Test1'), ArticleType, {'headline'}))
+        self.assertIsNone(get_projection(Comment.query(), ArticleType, {'headline'}))
+
+    def test_getProjection_overriddenFields_returnsNone(self):
+        class SummaryHeadlineArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                skip_registry = True
+
+            def resolve_headline(self, info):
+                return self.summary
+
+        class DeclaredHeadlineArticleType(NdbObjectType):
+            class Meta:
+                model = Article
+                skip_registry = True
+
+            headline = graphene.String()
+
+        query = Article.query()
+        self.assertEqual(get_projection(query, SummaryHeadlineArticleType, {'summary'}), ('summary',))
+        self.assertIsNone(get_projection(query, SummaryHeadlineArticleType, {'headline'}))
+        self.assertIsNone(get_projection(query, DeclaredHeadlineArticleType, {'headline'}))
+
+    def test_connectionField_cached(self):
+        query = """
+            query Articles {
+                cachedArticles(first: 2) {
+                    edges {
+                        cursor,
+                        node {
+                            headline
+                        }
+                    }
+                    pageInfo {
+                        hasNextPage
+                    }
+                }
+            }
+        """
+
+        a1 = Article(headline="Test1", summary="1").put()
+        Article(headline="Test2", summary="2").put()
+
+        result = schema.execute(query)
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        articles = result.data['cachedArticles']['edges']
+        self.assertListEqual([a['node']['headline'] for a in articles], ['Test1', 'Test2'])
+
+        # Served from cache - nodes are fetched by key so they're up to date
+        Article(headline="Test3", summary="3").put()
+        article = a1.get()
+        article.headline = "Test1 - Updated"
+        article.put()
+
+        result = schema.execute(query)
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        cached_articles = result.data['cachedArticles']['edges']
+        self.assertListEqual([a['node']['headline'] for a in cached_articles], ['Test1 - Updated', 'Test2'])
+        self.assertListEqual([a['cursor'] for a in cached_articles], [a['cursor'] for a in articles])
+        self.assertFalse(result.data['cachedArticles']['pageInfo']['hasNextPage'])
+
+        invalidate_query_cache(Article)
+
+        result = schema.execute(query)
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertTrue(result.data['cachedArticles']['pageInfo']['hasNextPage'])
+
+    def test_connectionField_fetchPage(self):
+        for i in range(5):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        query = """
+            query Articles($after: String) {
+                pagedArticles(first: 2, after: $after) {
+                    edges {
+                        cursor,
+                        node { headline }
+                    }
+                    pageInfo { endCursor, hasNextPage }
+                }
+            }
+        """
+
+        headlines = []
+        after = None
+        for has_next_page in (True, True, False):
+            result = schema.execute(query, variable_values={'after': after})
+            self.assertEmpty(result.errors, msg=str(result.errors))
+
+            paged_articles = result.data['pagedArticles']
+            self.assertEqual(paged_articles['pageInfo']['hasNextPage'], has_next_page)
+            self.assertEqual(paged_articles['pageInfo']['endCursor'], paged_articles['edges'][-1]['cursor'])
+
+            headlines.extend(e['node']['headline'] for e in paged_articles['edges'])
+            after = paged_articles['pageInfo']['endCursor']
+
+        self.assertListEqual(headlines, ['Test0', 'Test1', 'Test2', 'Test3', 'Test4'])
+
+    def test_connectionField_fetchPage_cursorNotSelected_skipsEdgeCursors(self):
+        for i in range(3):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        with mock.patch('graphene_gae.ndb.fields.batch_cursor', wraps=batch_cursor) as cursor_after:
+            result = schema.execute("""
+                query Articles {
+                    pagedArticles(first: 2) {
+                        edges {
+                            node { headline }
+                        }
+                        pageInfo { endCursor, hasNextPage }
+                    }
+                }
+            """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+
+        paged_articles = result.data['pagedArticles']
+        self.assertListEqual([e['node']['headline'] for e in paged_articles['edges']], ['Test0', 'Test1'])
+        self.assertIsNotNone(paged_articles['pageInfo']['endCursor'])
+        self.assertTrue(paged_articles['pageInfo']['hasNextPage'])
+
+        # Only the end cursor is computed
+        self.assertEqual(cursor_after.call_count, 1)
+
+    def test_connectionField_backwardPagination(self):
+        for i in range(5):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        query = """
+            query Articles($before: String) {
+                articles(last: 2, before: $before) {
+                    edges {
+                        cursor,
+                        node { headline }
+                    }
+                    pageInfo { startCursor, endCursor, hasPreviousPage, hasNextPage }
+                }
+            }
+        """
+
+        result = schema.execute(query)
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        articles = result.data['articles']
+        self.assertListEqual([e['node']['headline'] for e in articles['edges']], ['Test3', 'Test4'])
+        self.assertTrue(articles['pageInfo']['hasPreviousPage'])
+        self.assertFalse(articles['pageInfo']['hasNextPage'])
+
+        # Edge cursors can be used to paginate forward
+        forward_result = schema.execute("""
+            query Articles($after: String) {
+                articles(first: 2, after: $after) {
+                    edges { node { headline } }
+                }
+            }
+        """, variable_values={'after': articles['edges'][0]['cursor']})
+        self.assertEmpty(forward_result.errors, msg=str(forward_result.errors))
+        self.assertListEqual([e['node']['headline'] for e in forward_result.data['articles']['edges']], ['Test4'])
+
+        result = schema.execute(query, variable_values={'before': articles['pageInfo']['startCursor']})
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        articles = result.data['articles']
+        self.assertListEqual([e['node']['headline'] for e in articles['edges']], ['Test1', 'Test2'])
+        self.assertTrue(articles['pageInfo']['hasPreviousPage'])
+        self.assertTrue(articles['pageInfo']['hasNextPage'])
+
+        result = schema.execute(query, variable_values={'before': articles['pageInfo']['startCursor']})
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        articles = result.data['articles']
+        self.assertListEqual([e['node']['headline'] for e in articles['edges']], ['Test0'])
+        self.assertFalse(articles['pageInfo']['hasPreviousPage'])
+        self.assertTrue(articles['pageInfo']['hasNextPage'])
+
+    def test_connectionField_backwardPagination_beforeIsExclusive(self):
+        for i in range(5):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        for field_name in ('articles', 'pagedArticles'):
+            result = schema.execute('query Articles { %s(first: 5) { edges { cursor } } }' % field_name)
+            self.assertEmpty(result.errors, msg=str(result.errors))
+            cursors = [e['cursor'] for e in result.data[field_name]['edges']]
+
+            result = schema.execute("""
+                query Articles($before: String) {
+                    %s(last: 2, before: $before) {
+                        edges { cursor, node { headline } }
+                        pageInfo { startCursor, endCursor }
+                    }
+                }
+            """ % field_name, variable_values={'before': cursors[3]})
+            self.assertEmpty(result.errors, msg=str(result.errors))
+
+            articles = result.data[field_name]
+            self.assertListEqual([e['node']['headline'] for e in articles['edges']], ['Test1', 'Test2'])
+
+            # The page's cursors point after its edges, like forward pages' cursors
+            result = schema.execute("""
+                query Articles($before: String, $after: String) {
+                    previous: %s(last: 5, before: $before) { edges { node { headline } } }
+                    next: %s(first: 5, after: $after) { edges { node { headline } } }
+                }
+            """ % (field_name, field_name), variable_values={
+                'before': articles['pageInfo']['startCursor'],
+                'after': articles['pageInfo']['endCursor'],
+            })
+            self.assertEmpty(result.errors, msg=str(result.errors))
+            self.assertListEqual([e['node']['headline'] for e in result.data['previous']['edges']], ['Test0'])
+            self.assertListEqual([e['node']['headline'] for e in result.data['next']['edges']], ['Test3', 'Test4'])
+
+    def test_connectionField_backwardPagination_beforeEdgeDeleted(self):
+        article_keys = [Article(headline="Test%s" % i, summary=str(i)).put() for i in range(5)]
+
+        for field_name in ('articles', 'pagedArticles'):
+            result = schema.execute('query Articles { %s(first: 5) { edges { cursor } } }' % field_name)
+            self.assertEmpty(result.errors, msg=str(result.errors))
+            before = result.data[field_name]['edges'][3]['cursor']
+
+            article_keys[3].delete()
+            result = schema.execute("""
+                query Articles($before: String) {
+                    %s(last: 2, before: $before) { edges { node { headline } } }
+                }
+            """ % field_name, variable_values={'before': before})
+            self.assertEmpty(result.errors, msg=str(result.errors))
+            self.assertListEqual([e['node']['headline'] for e in result.data[field_name]['edges']], ['Test1', 'Test2'])
+
+            Article(key=article_keys[3], headline="Test3", summary="3").put()
+
+    def test_connectionFromNdbQuery_backwardPagination_inequalityFilter(self):
+        for i in range(5):
+            Article(headline="Test%s" % i, summary=str(4 - i)).put()
+
+        query = Article.query(Article.summary > '1')
+        self.assertEqual(reverse_query(query).orders, datastore_query.CompositeOrder([
+            datastore_query.PropertyOrder('summary'), datastore_query.PropertyOrder('__key__')
+        ]).reversed())
+
+        connection = connection_from_ndb_query(query, args={'last': 2})
+        self.assertListEqual([edge.node.headline for edge in connection.edges], ['Test1', 'Test0'])
+        self.assertTrue(connection.page_info.has_previous_page)
+
+    def test_connectionField_backwardPagination_endCursorOfLastEdge(self):
+        for i in range(3):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        result = schema.execute("""
+            query Articles {
+                articles(last: 2) {
+                    edges { cursor }
+                    pageInfo { startCursor, endCursor }
+                }
+            }
+        """)
+        self.assertEmpty(result.errors, msg=str(result.errors))
+
+        articles = result.data['articles']
+        self.assertEqual(articles['pageInfo']['startCursor'], articles['edges'][0]['cursor'])
+        self.assertEqual(articles['pageInfo']['endCursor'], articles['edges'][-1]['cursor'])
+
+        result = schema.execute("""
+            query Articles($after: String) {
+                articles(first: 2, after: $after) { edges { node { headline } } }
+            }
+        """, variable_values={'after': articles['pageInfo']['endCursor']})
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertEmpty(result.data['articles']['edges'])
+
+    def test_connectionField_forwardAndBackwardArguments_returnsError(self):
+        Article(headline="Test0", summary="0").put()
+        result = schema.execute('query Articles { articles(first: 1) { edges { cursor } } }')
+        cursor = result.data['articles']['edges'][0]['cursor']
+
+        for arguments in ('first: 1, before: $cursor', 'last: 1, after: $cursor', 'after: $cursor, before: $cursor'):
+            result = schema.execute(
+                'query Articles($cursor: String) { articles(%s) { edges { cursor } } }' % arguments,
+                variable_values={'cursor': cursor}
+            )
+            self.assertLength(result.errors, 1)
+            self.assertIn('at once', str(result.errors[0]))
+
+    def test_connectionField_fetchPage_backwardPagination(self):
+        for i in range(3):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        result = schema.execute("""
+            query Articles {
+                pagedArticles(last: 2) {
+                    edges {
+                        cursor,
+                        node { headline }
+                    }
+                    pageInfo { startCursor, hasPreviousPage, hasNextPage }
+                }
+            }
+        """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        articles = result.data['pagedArticles']
+        self.assertListEqual([e['node']['headline'] for e in articles['edges']], ['Test1', 'Test2'])
+        self.assertIsNotNone(articles['pageInfo']['startCursor'])
+        self.assertTrue(articles['pageInfo']['hasPreviousPage'])
+        self.assertFalse(articles['pageInfo']['hasNextPage'])
+
+    def test_connectionField_totalCount(self):
+        for i in range(3):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        result = schema.execute("""
+            query Articles {
+                articles(first: 1) {
+                    totalCount
+                    edges { node { headline } }
+                }
+                limitedCountArticles(first: 1) {
+                    totalCount
+                }
+                countedArticles {
+                    totalCount
+                }
+            }
+        """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertEqual(result.data['articles']['totalCount'], 3)
+        self.assertLength(result.data['articles']['edges'], 1)
+        self.assertEqual(result.data['limitedCountArticles']['totalCount'], 2)
+        self.assertEqual(result.data['countedArticles']['totalCount'], 42)
+
+    def test_countQueryAsync_cachedByCounter(self):
+        query = Article.query()
+        # Lambdas, which share their __name__
+        forty_two, forty_three = (lambda query: 42), (lambda query: 43)
+
+        self.assertEqual(count_query_async(query, cache_ttl=60, counter=forty_two).get_result(), 42)
+        self.assertEqual(count_query_async(query, cache_ttl=60, counter=forty_three).get_result(), 43)
+        self.assertEqual(count_query_async(query, cache_ttl=60, counter=partial(forty_two)).get_result(), 42)
+
+        self.assertEqual(
+            count_query_async(query, cache_ttl=60, counter=forty_three, counter_cache_key='counter').get_result(), 43
+        )
+        self.assertEqual(
+            count_query_async(query, cache_ttl=60, counter=forty_two, counter_cache_key='counter').get_result(), 43
+        )
+
+    def test_getCounterCacheKey(self):
+        one, two, reader_counter = lambda query: 1, lambda query: 2, partial(reader_filter)
+
+        self.assertEqual(get_counter_cache_key(transform_to_reader_edges), __name__ + '.transform_to_reader_edges')
+        self.assertNotEqual(get_counter_cache_key(one), get_counter_cache_key(two))
+        self.assertEqual(get_counter_cache_key(reader_counter), repr(reader_counter))
+
+    def test_connectionField_totalCountNotSelected_doesntCount(self):
+        Article(headline="Test1", summary="1").put()
+
+        with mock.patch('graphene_gae.ndb.fields.count_query_async') as count_query_async:
+            result = schema.execute("""
+                query Articles {
+                    articles {
+                        edges { node { headline } }
+                    }
+                }
+            """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertFalse(count_query_async.called)
+
+    def test_connectionField_siblingConnections_fetchedInParallel(self):
+        for i in range(3):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        events = []
+
+        def tracked_connection_from_ndb_query_async(query, **kwargs):
+            events.append('start')
+            future = connection_from_ndb_query_async(query, **kwargs)
+            future.add_callback(events.append, 'done')
+            return future
+
+        with mock.patch('graphene_gae.ndb.fields.connection_from_ndb_query_async', tracked_connection_from_ndb_query_async):
+            result = schema.execute("""
+                query Articles {
+                    articles(first: 2) { edges { node { headline } } }
+                    pagedArticles(first: 2) { edges { node { headline } } }
+                }
+            """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertLength(result.data['articles']['edges'], 2)
+        self.assertLength(result.data['pagedArticles']['edges'], 2)
+        self.assertEqual(events, ['start', 'start', 'done', 'done'])
+
+    def test_connectionField_notTruncated(self):
+        Article(headline="Test1", summary="1").put()
+
+        result = schema.execute("""
+            query Articles {
+                articles { pageInfo { truncated hasNextPage } }
+            }
+        """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertFalse(result.data['articles']['pageInfo']['truncated'])
+        self.assertFalse(result.data['articles']['pageInfo']['hasNextPage'])
+
+    def test_connectionField_deadlineExceeded_truncatesPage(self):
+        Article(headline="Test1", summary="1").put()
+
+        result = schema.execute("""
+            query Articles {
+                deadlineArticles {
+                    edges { node { headline } }
+                    pageInfo { truncated hasNextPage }
+                }
+            }
+        """)
+
+        self.assertEmpty(result.errors, msg=str(result.errors))
+        self.assertEmpty(result.data['deadlineArticles']['edges'])
+        self.assertTrue(result.data['deadlineArticles']['pageInfo']['truncated'])
+        self.assertTrue(result.data['deadlineArticles']['pageInfo']['hasNextPage'])
+
+    def test_generateEdgesPage_timeouts_retriedPerPolicy(self):
+        article = Article(headline="Test1", summary="1")
+        ndb_iter = mock.Mock()
+        ndb_iter.next.side_effect = [Timeout(), Timeout(), article, StopIteration()]
+
+        retry_budget = RetryPolicy(max_retries=2).start()
+        edges = generate_edges_page(ndb_iter, 10, False, ArticleType._meta.connection.Edge, retry_budget=retry_budget)
+
+        self.assertEqual([edge.node for edge in edges], [article])
+        self.assertFalse(retry_budget.truncated)
+
+    def test_generateEdgesPage_timeoutsExhausted_truncatesPage(self):
+        ndb_iter = mock.Mock()
+        ndb_iter.next.side_effect = Timeout()
+
+        retry_budget = RetryPolicy(max_retries=1).start()
+        edges = generate_edges_page(ndb_iter, 10, False, ArticleType._meta.connection.Edge, retry_budget=retry_budget)
+
+        self.assertEmpty(edges)
+        self.assertTrue(retry_budget.truncated)
+        self.assertEqual(ndb_iter.next.call_count, 2)
+
+    def test_generateEdgesPage_backoff_sleepsWithoutBlocking(self):
+        article = Article(headline="Test1", summary="1")
+        ndb_iter = mock.Mock()
+        ndb_iter.next.side_effect = [Timeout(), article, StopIteration()]
+
+        retry_budget = RetryPolicy(max_retries=1, backoff=0.01).start()
+        with mock.patch.object(ndb, 'sleep', wraps=ndb.sleep) as sleep:
+            edges = generate_edges_page(ndb_iter, 10, False, ArticleType._meta.connection.Edge, retry_budget=retry_budget)
+
+        self.assertEqual([edge.node for edge in edges], [article])
+        sleep.assert_called_once_with(0.01)
+
+    def test_retryBudget_backoffDoubles(self):
+        retry_budget = RetryPolicy(max_retries=3, backoff=0.1).start()
+
+        self.assertEqual([retry_budget.retry_delay() for _ in range(4)], [0.1, 0.2, 0.4, None])
+        self.assertTrue(retry_budget.truncated)
+
+    def test_keysToGlobalIds_encodesEachKeyOnce(self):
+        key_id_cache.clear()
+        keys = [ndb.Key('Tag', 1), ndb.Key('Tag', 2), ndb.Key('Tag', 1)]
+        expected = [to_global_id('TagType', key.urlsafe()) for key in keys]
+
+        with mock.patch('graphene_gae.ndb.fields.to_global_id', wraps=to_global_id) as encode:
+            self.assertEqual(keys_to_global_ids('TagType', keys), expected)
+            self.assertEqual(encode.call_count, 2)
+
+            self.assertEqual(keys_to_global_ids('TagType', keys), expected)
+            self.assertEqual(encode.call_count, 2)
+
+    def test_lazyCursor_encodedOnlyWhenSerialized(self):
+        cursor = mock.Mock()
+        cursor.urlsafe.return_value = 'urlsafe-cursor'
+
+        lazy_cursor = LazyCursor(cursor)
+        self.assertFalse(cursor.urlsafe.called)
+
+        self.assertEqual(str(lazy_cursor), 'urlsafe-cursor')
+        self.assertEqual(lazy_cursor.urlsafe(), 'urlsafe-cursor')
+        cursor.urlsafe.assert_called_once_with()
+
+    def test_lazyCursor_beforeCursor_holdsBothPositions(self):
+        cursor, before_cursor = mock.Mock(), mock.Mock()
+        cursor.urlsafe.return_value = 'after-cursor'
+        before_cursor.urlsafe.return_value = 'before-cursor'
+
+        self.assertEqual(str(LazyCursor(cursor, before_cursor)), 'after-cursor.before-cursor')
+
+    def test_lazyCursor_batch_computedOnlyWhenSerialized(self):
+        cursors = {4: mock.Mock(), 5: mock.Mock()}
+        cursors[4].urlsafe.return_value = 'cursor-4'
+        cursors[5].urlsafe.return_value = 'cursor-5'
+        batch = mock.Mock()
+        batch.cursor.side_effect = cursors.get
+
+        lazy_cursor = LazyCursor(batch=batch, index=4)
+        self.assertFalse(batch.cursor.called)
+
+        # The cursor after the result, then the one before it
+        self.assertEqual(str(lazy_cursor), 'cursor-5.cursor-4')
+
+    def test_lazyCursor_comparesAsUrlsafeString(self):
+        cursor = mock.Mock()
+        cursor.urlsafe.return_value = 'urlsafe-cursor'
+
+        lazy_cursor = LazyCursor(cursor)
+        self.assertEqual(lazy_cursor, 'urlsafe-cursor')
+        self.assertEqual(lazy_cursor, LazyCursor(cursor))
+        self.assertNotEqual(lazy_cursor, 'other-cursor')
+        self.assertEqual(hash(lazy_cursor), hash('urlsafe-cursor'))
+        self.assertEqual(u'%s' % lazy_cursor, u'urlsafe-cursor')
+
+    def test_connectionFromNdbQuery_encodesEdgeCursors(self):
+        for i in range(3):
+            Article(headline="Test%s" % i, summary=str(i)).put()
+
+        transformed_cursors = []
+
+        def transform_edges(edges, args, context):
+            transformed_cursors.extend(edge.cursor for edge in edges)
+            return edges
+
+        connection = connection_from_ndb_query(Article.query(), args={'first': 2}, transform_edges=transform_edges)
+
+        self.assertLength(connection.edges, 2)
+        for edge in connection.edges:
+            self.assertIsInstance(edge.cursor, str)
+
+        self.assertListEqual(transformed_cursors, [edge.cursor for edge in connection.edges])
+        for cursor in transformed_cursors:
+            self.assertIsInstance(cursor, str)
+
+    def test_lazyCursor_reverse_reversesCursorsAroundResult(self):
+        cursors = {4: mock.Mock(), 5: mock.Mock()}
+        cursors[4].reversed.return_value.urlsafe.return_value = 'reversed-cursor-4'
+        cursors[5].reversed.return_value.urlsafe.return_value = 'reversed-cursor-5'
+        batch = mock.Mock()
+        batch.cursor.side_effect = cursors.get
+
+        # The reversed query's cursor before the result is the position after it in the original order
+        lazy_cursor = LazyCursor(batch=batch, index=4, reverse=True)
+        self.assertEqual(str(lazy_cursor), 'reversed-cursor-4.reversed-cursor-5')
+
+    def test_parseCursor(self):
+        Article(headline="Test0", summary="0").put()
+        ndb_iter = Article.query().iter(produce_cursors=True)
+        ndb_iter.next()
+        after, before = ndb_iter.cursor_after(), ndb_iter.cursor_before()
+
+        self.assertEqual(parse_cursor(after.urlsafe() + '.' + before.urlsafe()), (after, before))
+        self.assertEqual(parse_cursor(after.urlsafe()), (after, after))
+
     def test_connectionField_empty(self):
         Article(headline="Test1", summary="1").put()
 
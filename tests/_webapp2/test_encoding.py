@@ -0,0 +1,45 @@
+import json
+from io import BytesIO
+
+import mock
+import webob
+
+from tests.base_test import BaseTest
+
+from graphene_gae.webapp2 import encoding
+
+__author__ = 'ekampf'
+
+
+class TestEncoding(BaseTest):
+    data = {'data': {'articles': [{'id': i, 'headline': u'Headline \u2603 %s' % i} for i in range(100)]}}
+
+    def testDumps_pretty(self):
+        self.assertEqual(encoding.dumps({'b': 1, 'a': [1]}, pretty=True), '{\n  "a": [\n    1\n  ],\n  "b": 1\n}')
+
+    def testWriteJson_writesInChunks(self):
+        for pretty in (False, True):
+            out = mock.Mock(wraps=BytesIO())
+            encoding.write_json(out, self.data, pretty=pretty, chunk_size=256)
+
+            body = b''.join(call[0][0] for call in out.write.call_args_list)
+            self.assertEqual(json.loads(body.decode('utf-8')), self.data)
+            self.assertEqual(body.decode('utf-8'), encoding.dumps(self.data, pretty=pretty))
+            self.assertTrue(out.write.call_count > 1)
+
+    def testWriteJson_returnsMd5Etag(self):
+        out = BytesIO()
+        etag = encoding.write_json(out, self.data)
+
+        response = webob.Response(body=out.getvalue())
+        response.md5_etag()
+        self.assertEqual(etag, response.etag)
+
+    def testSetBackend(self):
+        backend = encoding.backend
+        try:
+            encoding.set_backend('json')
+            self.assertIs(encoding.backend, json)
+            self.assertEqual(encoding.dumps([1]), '[1]')
+        finally:
+            encoding.backend = backend
@@ -1,11 +1,21 @@
 import webapp2
 from tests.base_test import BaseTest
 
+from google.appengine.ext import ndb
+
 import json
+import mock
 import webtest
 import graphene
 from graphene import relay
-from graphene_gae.webapp2 import graphql_application, GraphQLHandler
+from graphql.execution import execute
+from graphene_gae.webapp2 import graphql_application, GraphQLHandler, document_cache, get_document
+from graphene_gae.webapp2.persisted_queries import get_query_hash, persist_query, persisted_query_cache
+from graphene_gae.webapp2.persisted_queries import get_registered_query, GraphQLPersistedQuery, REGISTERED_QUERY_KEY_PREFIX
+from graphql_relay import to_global_id
+
+from tests._ndb.test_types_relay import schema as ndb_schema
+from tests.models import Article
 
 __author__ = 'ekampf'
 
@@ -15,10 +25,14 @@ class QueryRootType(graphene.ObjectType):
 
     greet = graphene.Field(graphene.String, who=graphene.Argument(graphene.String))
     resolver_raises = graphene.String()
+    viewer = graphene.String()
 
     def resolve_greet(self, info, who):
         return 'Hello %s!' % who
 
+    def resolve_viewer(self, info):
+        return info.context.headers.get('Authorization')
+
     def resolve_resolver_raises(self, info):
         raise Exception("TEST")
 
@@ -230,3 +244,302 @@ class TestGraphQLHandler(BaseTest):
         response = self.app.post('/graphql?pretty=True', params='query helloYou { greet(who: "You") }')
         self.assertEqual(response.body, '{\n  "data": {\n    "greet": "Hello You!"\n  }\n}')
 
+    def test_responseCache_servesCachedResponseWithoutExecuting(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60)))
+
+        with mock.patch('graphene_gae.webapp2.execute', wraps=execute) as execute_mock:
+            response = app.get('/graphql', params=dict(query='query helloYou { greet(who: "You") }'))
+            self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+            etag = response.etag
+
+            # Same query, formatted differently
+            response = app.get('/graphql', params=dict(query='query helloYou {\n  greet(who: "You")\n}'))
+            self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+            self.assertEqual(response.etag, etag)
+
+            response = app.get('/graphql', params=dict(query='query helloYou { greet(who: "You") }'),
+                               headers={'If-None-Match': '"%s"' % etag})
+            self.assertEqual(response.status_int, 304)
+            self.assertEqual(response.body, '')
+
+            response = app.get('/graphql', params=dict(query='query helloMe { greet(who: "Me") }'))
+            self.assertEqual(response.json_body['data'], {'greet': 'Hello Me!'})
+
+        self.assertEqual(execute_mock.call_count, 2)
+
+    def test_responseCache_mutationsNotCached(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60)))
+
+        query = 'mutation M { changeDefaultGreeting(input: { value: "universe" }) { ok } }'
+        with mock.patch('graphene_gae.webapp2.execute', wraps=execute) as execute_mock:
+            app.get('/graphql', params=dict(query=query))
+            app.get('/graphql', params=dict(query=query))
+
+        self.assertEqual(execute_mock.call_count, 2)
+
+    def test_responseCache_requestsWithCredentialsNotShared(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60)))
+
+        query = 'query viewer { viewer }'
+        response = app.get('/graphql', params=dict(query=query), headers={'Authorization': 'Bearer alice'})
+        self.assertEqual(response.json_body['data'], {'viewer': 'Bearer alice'})
+
+        response = app.get('/graphql', params=dict(query=query), headers={'Authorization': 'Bearer bob'})
+        self.assertEqual(response.json_body['data'], {'viewer': 'Bearer bob'})
+
+        with mock.patch('graphene_gae.webapp2.execute', wraps=execute) as execute_mock:
+            app.get('/graphql', params=dict(query=query), headers={'Cookie': 'session=alice'})
+            app.get('/graphql', params=dict(query=query), headers={'Cookie': 'session=alice'})
+
+        self.assertEqual(execute_mock.call_count, 2)
+
+    def test_responseCache_scopedBySubclass(self):
+        class ScopedGraphQLHandler(GraphQLHandler):
+            def _get_response_cache_scope(self):
+                return self.request.headers.get('Authorization')
+
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', ScopedGraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60)))
+
+        query = 'query viewer { viewer }'
+        with mock.patch('graphene_gae.webapp2.execute', wraps=execute) as execute_mock:
+            for viewer in ('Bearer alice', 'Bearer bob', 'Bearer alice'):
+                response = app.get('/graphql', params=dict(query=query), headers={'Authorization': viewer})
+                self.assertEqual(response.json_body['data'], {'viewer': viewer})
+
+        self.assertEqual(execute_mock.call_count, 2)
+
+    def test_responseCache_oversizedResponseNotCached(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60)))
+
+        query = 'query helloWho { greet(who: "%s") }' % ('x' * 2048)
+        with mock.patch('graphene_gae.webapp2.RESPONSE_CACHE_MAX_SIZE', 1024), \
+                mock.patch('graphene_gae.webapp2.execute', wraps=execute) as execute_mock:
+            for _ in range(2):
+                response = app.get('/graphql', params=dict(query=query))
+                self.assertEqual(response.json_body['data'], {'greet': 'Hello %s!' % ('x' * 2048)})
+
+        self.assertEqual(execute_mock.call_count, 2)
+
+    def test_responseCache_memcacheRejectsResponse_stillResponds(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60)))
+
+        query = 'query helloWorld { greet(who: "World") }'
+        with mock.patch('graphene_gae.webapp2.memcache.set', side_effect=ValueError('Values may not be more than 1000000 bytes')):
+            response = app.get('/graphql', params=dict(query=query))
+
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.json_body, {'data': {'greet': 'Hello World!'}})
+
+    def test_persistedQueries_registeredByClient(self):
+        persisted_query_cache.clear()
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_persisted_queries=True)))
+
+        query = 'query helloYou { greet(who: "You") }'
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash(query)}}
+
+        response = app.post('/graphql', params=json.dumps(dict(extensions=extensions)))
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.json_body, {'errors': [
+            {'message': 'PersistedQueryNotFound', 'extensions': {'code': 'PERSISTED_QUERY_NOT_FOUND'}}
+        ]})
+
+        response = app.post('/graphql', params=json.dumps(dict(query=query, extensions=extensions)))
+        self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+
+        # Served by hash alone from now on, from memcache rather than the datastore
+        self.assertEqual(GraphQLPersistedQuery.query().count(), 0)
+        response = app.get('/graphql', params=dict(extensions=json.dumps(extensions)))
+        self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+
+        response = app.post('/graphql', params=json.dumps(dict(extensions=extensions)))
+        self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+
+    def test_persistedQueries_invalidQueryNotRegistered(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_persisted_queries=True)))
+
+        query = 'query helloYou { greet(whom: "You") }'
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash(query)}}
+
+        response = app.post('/graphql', params=json.dumps(dict(query=query, extensions=extensions)), expect_errors=True)
+        self.assertEqual(response.status_int, 400)
+        self.assertIsNone(get_registered_query(get_query_hash(query)))
+
+        response = app.post('/graphql', params=json.dumps(dict(extensions=extensions)))
+        self.assertEqual(response.json_body['errors'][0]['message'], 'PersistedQueryNotFound')
+
+    def test_persistedQueries_registeredQueriesExpire(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_persisted_queries=True, graphql_persisted_query_ttl=60)))
+
+        query = 'query helloYou { greet(who: "You") }'
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash(query)}}
+
+        with mock.patch('graphene_gae.webapp2.persisted_queries.memcache.set') as memcache_set:
+            app.post('/graphql', params=json.dumps(dict(query=query, extensions=extensions)))
+
+        memcache_set.assert_called_once_with(REGISTERED_QUERY_KEY_PREFIX + get_query_hash(query), query, time=60)
+
+    def test_persistedQueries_hashMismatch_returns400(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_persisted_queries=True)))
+
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash('query { greet }')}}
+        response = app.post('/graphql', expect_errors=True, params=json.dumps(dict(
+            query='query helloYou { greet(who: "You") }', extensions=extensions
+        )))
+
+        self.assertEqual(response.status_int, 400)
+        self.assertEqual(response.json_body['errors'][0]['message'], 'Provided sha256Hash does not match query.')
+
+    def test_persistedQueriesOnly_executesOnlyStoredQueries(self):
+        persisted_query_cache.clear()
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_persisted_queries_only=True)))
+
+        query = 'query helloYou { greet(who: "You") }'
+        query_hash = persist_query(query)
+        response = app.post('/graphql', params=json.dumps(dict(
+            extensions={'persistedQuery': {'version': 1, 'sha256Hash': query_hash}}
+        )))
+        self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+
+        response = app.post('/graphql', params=json.dumps(dict(query=query)), expect_errors=True)
+        self.assertEqual(response.status_int, 400)
+
+        other_query = 'query helloMe { greet(who: "Me") }'
+        response = app.post('/graphql', expect_errors=True, params=json.dumps(dict(
+            query=other_query,
+            extensions={'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash(other_query)}}
+        )))
+        self.assertEqual(response.status_int, 400)
+        self.assertEqual(response.json_body['errors'][0]['message'], 'Only persisted queries are allowed.')
+
+    def test_documentCache_parsesAndValidatesOnce(self):
+        document_cache.clear()
+        query = 'query helloYou { greet(who: "You") }'
+
+        with mock.patch('graphene_gae.webapp2.validate', return_value=[]) as validate:
+            for method in (self.get, self.post):
+                response = method('/graphql', params=dict(query=query))
+                self.assertEqual(response.json_body['data'], {'greet': 'Hello You!'})
+
+        self.assertEqual(validate.call_count, 1)
+
+    def test_documentCache_keyedBySchema(self):
+        other_schema = graphene.Schema(query=QueryRootType)
+        query = 'query helloYou { greet(who: "You") }'
+
+        document, errors = get_document(schema, query)
+        self.assertEmpty(errors)
+        self.assertIs(get_document(schema, query)[0], document)
+        self.assertIsNot(get_document(other_schema, query)[0], document)
+
+    def test_documentCache_cachesErrors(self):
+        document, errors = get_document(schema, 'syntaxerror')
+        self.assertIsNone(document)
+        self.assertLength(errors, 1)
+        self.assertIs(get_document(schema, 'syntaxerror')[1], errors)
+
+    def testPOST_batch_returnsArrayOfResults(self):
+        response = self.app.post('/graphql', params=json.dumps([
+            dict(query='query helloYou { greet(who: "You") }'),
+            dict(query='query helloWho($who: String) { greet(who: $who) }', variables={'who': 'Dolly'}),
+            dict(query='syntaxerror'),
+        ]))
+
+        self.assertEqual(response.status_int, 200)
+        results = response.json_body
+        self.assertLength(results, 3)
+        self.assertEqual(results[0], {'data': {'greet': 'Hello You!'}})
+        self.assertEqual(results[1], {'data': {'greet': 'Hello Dolly!'}})
+        self.assertNotIn('data', results[2])
+        self.assertLength(results[2]['errors'], 1)
+
+    def testPOST_batch_persistedQueryNotFound_reportedPerOperation(self):
+        persisted_query_cache.clear()
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_persisted_queries=True)))
+
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash('query helloMe { greet(who: "Me") }')}}
+        response = app.post('/graphql', params=json.dumps([
+            dict(query='query helloYou { greet(who: "You") }'),
+            dict(extensions=extensions),
+        ]))
+
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.json_body, [
+            {'data': {'greet': 'Hello You!'}},
+            {'errors': [{'message': 'PersistedQueryNotFound', 'extensions': {'code': 'PERSISTED_QUERY_NOT_FOUND'}}]},
+        ])
+
+    def testPOST_batch_tooLarge_returns400(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_max_batch_size=1)))
+
+        response = app.post('/graphql', expect_errors=True, params=json.dumps([
+            dict(query='query helloYou { greet(who: "You") }'),
+            dict(query='query helloMe { greet(who: "Me") }'),
+        ]))
+
+        self.assertEqual(response.status_int, 400)
+
+    def testPOST_batch_coalescesKeyLookupsAcrossOperations(self):
+        article_keys = [Article(headline="Test%s" % i, summary=str(i)).put() for i in range(2)]
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=ndb_schema)))
+
+        query = 'query Article($id: ID!) { node(id: $id) { ... on ArticleType { headline } } }'
+        with mock.patch.object(ndb, 'get_multi_async', wraps=ndb.get_multi_async) as get_multi_async:
+            response = app.post('/graphql', params=json.dumps([
+                dict(query=query, variables={'id': to_global_id('ArticleType', key.urlsafe())}) for key in article_keys
+            ]))
+
+        self.assertEqual([result['data']['node']['headline'] for result in response.json_body], ['Test0', 'Test1'])
+        self.assertEqual(get_multi_async.call_count, 1)
+
+    def test_streamResponses_writesSameResponse(self):
+        responses = []
+        for stream_responses in (False, True):
+            app = webtest.TestApp(webapp2.WSGIApplication([
+                ('/graphql', GraphQLHandler)
+            ], config=dict(graphql_schema=schema, graphql_pretty=True, graphql_stream_responses=stream_responses)))
+
+            responses.append(app.get('/graphql', params=dict(query='query helloYou { greet(who: "You") }')))
+
+        self.assertEqual(responses[1].body, '{\n  "data": {\n    "greet": "Hello You!"\n  }\n}')
+        self.assertEqual(responses[1].body, responses[0].body)
+        self.assertEqual(responses[1].etag, responses[0].etag)
+        self.assertEqual(responses[1].content_type, 'application/json')
+
+    def test_streamResponses_servedFromResponseCache(self):
+        app = webtest.TestApp(webapp2.WSGIApplication([
+            ('/graphql', GraphQLHandler)
+        ], config=dict(graphql_schema=schema, graphql_response_cache_ttl=60, graphql_stream_responses=True)))
+
+        response = app.get('/graphql', params=dict(query='query helloYou { greet(who: "You") }'))
+        cached_response = app.get('/graphql', params=dict(query='query helloYou { greet(who: "You") }'))
+
+        self.assertEqual(cached_response.body, response.body)
+        self.assertEqual(cached_response.etag, response.etag)
@@ -1,4 +1,5 @@
 from google.appengine.ext import ndb
+from google.appengine.ext.ndb import polymodel
 
 __author__ = 'ekampf'
 
@@ -61,3 +62,10 @@ class Article(ndb.Model):
         import hashlib
         return hashlib.md5(self.body).hexdigit() if self.body else None
 
+
+class Animal(polymodel.PolyModel):
+    name = ndb.StringProperty()
+
+
+class Dog(Animal):
+    breed = ndb.StringProperty()
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+from tests.base_test import BaseTest
+
+__author__ = 'ekampf'
+
+
+class TestLazyImport(BaseTest):
+
+    def __imported_modules(self, code):
+        # Run in a fresh interpreter, this process imported everything already
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        output = subprocess.check_output([sys.executable, '-c', 'import sys\n%s\nprint(" ".join(sys.modules))' % code], env=env)
+        return set(output.decode('utf-8').split())
+
+    def testImport_doesntImportGrapheneOrNdbModules(self):
+        modules = self.__imported_modules('import graphene_gae')
+
+        self.assertIn('graphene_gae', modules)
+        self.assertNotIn('graphene', modules)
+        self.assertNotIn('graphene_gae.ndb.types', modules)
+        self.assertNotIn('inflect', modules)
+
+    def testNdbObjectType_importedOnFirstAccess_withoutInflect(self):
+        modules = self.__imported_modules('import graphene_gae\ngraphene_gae.NdbObjectType')
+
+        self.assertIn('graphene_gae.ndb.types', modules)
+        self.assertNotIn('inflect', modules)
+
+    def testFromImport(self):
+        from graphene_gae import NdbObjectType, NdbConnectionField
+        from graphene_gae.ndb.types import NdbObjectType as ndb_object_type
+        from graphene_gae.ndb.fields import NdbConnectionField as ndb_connection_field
+
+        self.assertIs(NdbObjectType, ndb_object_type)
+        self.assertIs(NdbConnectionField, ndb_connection_field)
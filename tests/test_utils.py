@@ -0,0 +1,34 @@
+from tests.base_test import BaseTest
+
+from graphene_gae.utils import LRUCache
+
+__author__ = 'ekampf'
+
+
+class TestLRUCache(BaseTest):
+
+    def testGet_missingKey_returnsDefault(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 1), 1)
+
+    def testSet_overMaxSize_evictsLeastRecentlyUsed(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def testGetMany_setMany(self):
+        cache = LRUCache()
+        cache.set_many([('a', 1), ('b', 2)])
+
+        self.assertEqual(cache.get_many(['a', 'x', 'b']), [1, None, 2])
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)